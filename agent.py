@@ -1,5 +1,14 @@
+import time
 import numpy as np
 import map
+import transition
+import history as h
+import sweeping
+import rollout
+import parallel
+import multigrid
+import cache as c
+import observers
 from copy import deepcopy
 # Reward Dictionary
 REWARD = {
@@ -12,6 +21,8 @@ REWARD = {
 
 # Cardinal Directions (Useful to compare with the action)
 CARDINAL_DIRECTIONS = ('North', 'East', 'South', 'West')
+# Bit of each direction in map.Maze.move_mask
+MOVE_BITS = {action: 1 << bit for bit, action in enumerate(CARDINAL_DIRECTIONS)}
 
 # Probability of agent movements
 #      0.8
@@ -24,11 +35,29 @@ PROBABILITY_OF_FAILURE = 0.1
 DISCOUNT_FACTOR = 0.99
 
 class Agent:
-    def __init__(self, maze: map.Maze, start_x=0, start_y=0 ):
+    def __init__(self, maze: map.Maze, start_x=0, start_y=0, discount_factor=DISCOUNT_FACTOR,
+                 probability_of_success=PROBABILITY_OF_SUCCESS, probability_of_failure=PROBABILITY_OF_FAILURE, reward=REWARD,
+                 reachable_only=False):
+        # Same limits as the settings of sensitivity.SettingsModel, the agent slips to each side
+        # with probability_of_failure and a larger slip leaves a negative chance of success
+        if not 0 <= probability_of_failure <= 0.5:
+            raise ValueError("Invalid slip, must be between 0 and 0.5")
+        if not 0 <= probability_of_success <= 1:
+            raise ValueError("Invalid probability of success, must be between 0 and 1")
         #Initialize agent at starting position
         self.position_x = start_x
         self.position_y = start_y
         self.maze = maze
+        # Parameters of the problem solved by this agent, the module constants by default
+        self.discount_factor = discount_factor
+        self.probability_of_success = probability_of_success
+        self.probability_of_failure = probability_of_failure
+        self.reward = reward
+        # Solve only the tiles reachable from the start position, tiles walled off from it are
+        # left out of the array solvers and come back as -inf like walls
+        self.reachable_only = reachable_only
+        # Reward of each tile code, so that the reward of one tile is read without a reward grid
+        self.tile_rewards = [reward[tile] for tile in map.TILES]
 
     def initalise_utility_matrix(self):
         # Initialize the utility matrix with zeroes
@@ -44,44 +73,24 @@ class Agent:
         policy_map = np.full((self.maze.rows, self.maze.cols), CARDINAL_DIRECTIONS[0])
         for row in range(self.maze.rows):
             for col in range(self.maze.cols):
-                if self.maze.layout[row][col] == 'W':
-                    policy_map[row][col] = None
-                policy_map[row][col] = self.get_possible_moves(row, col)[0]
+                possible_moves = self.get_possible_moves(row, col)
+                # Tiles enclosed by walls have no possible move and keep the first direction
+                if possible_moves:
+                    policy_map[row][col] = possible_moves[0]
         return policy_map
 
     def get_possible_moves(self, x, y):
-        possible_moves = []
-        # Move agent based on action
-        for action in CARDINAL_DIRECTIONS:
-            if self.check_move(action, x, y):
-                possible_moves.append(action)
-        return possible_moves
+        # Read legal moves from the maze's move mask
+        move_mask = self.maze.move_mask.item(x, y)
+        return [action for action in CARDINAL_DIRECTIONS if move_mask & MOVE_BITS[action]]
             
     def check_move(self, action, x, y):
-        # Remember current position
-        next_position_x, next_position_y = x, y
-        # Move agent based on action
-        if action == "East":
-            next_position_y += 1
-        elif action == "West":
-            next_position_y -= 1
-        elif action == "North":
-            next_position_x -= 1
-        elif action == "South":
-            next_position_x += 1
-        else:
+        # Moving out of bounds or into a wall is not legal and puts the agent back in the same position
+        try:
+            bit = MOVE_BITS[action]
+        except KeyError:
             raise ValueError("Invalid action")
-        
-        # Assumption that it is legal for agent to move out of bounds
-        # However, it will act like a wall and put the player back in the same position
-        if next_position_y < 0 or next_position_y >= self.maze.cols:
-            return False
-        if next_position_x < 0 or next_position_x >= self.maze.rows:
-            return False
-        # Check if agent hit a wall
-        elif self.maze.layout[next_position_x][next_position_y] == 'W':
-            return False
-        return True
+        return bool(self.maze.move_mask.item(x, y) & bit)
     
     def move(self, action, x, y):
         # Move agent based on action
@@ -105,132 +114,260 @@ class Agent:
             return utility_matrix[x][y]
     
     def get_reward(self, x, y):
-        return REWARD[self.maze.layout[x][y]]
+        return self.tile_rewards[self.maze.tiles.item(x, y)]
     
     def update_position(self, action):
         action_pos = CARDINAL_DIRECTIONS.index(action)
         # Check randomly if successful, rand() produces a float 0 to 1
-        if(np.random.rand() < PROBABILITY_OF_SUCCESS):
+        if(np.random.rand() < self.probability_of_success):
             pass
         else:
             # Randomly choose a direction either left or right of the intended direction
             action_pos = action_pos + np.random.choice([-1, 1])
             action_pos = action_pos % 4
         # Move the agent based on action
-        if self.check_move(CARDINAL_DIRECTIONS[action_pos]):
+        if self.check_move(CARDINAL_DIRECTIONS[action_pos], self.position_x, self.position_y):
             self.position_x, self.position_y = self.move(CARDINAL_DIRECTIONS[action_pos], self.position_x, self.position_y)
         else:
             # If agent hits a wall, stay in the same position
             pass
     
-    def value_iteration(self, iterations, epsilon):
-        # epsilon is the maxmium allowed change in utility of any state in iteration
-        utility_matrix = self.initalise_utility_matrix()
-        utility_history = {}
+    def transition_model(self, reachable_only=False):
+        # Build the transition structure of the maze as index arrays, over the tiles reachable
+        # from the start position only if reachable_only
+        start = self.position_x * self.maze.cols + self.position_y if reachable_only else None
+        return transition.TransitionModel(self.maze, self.reward, self.probability_of_success, self.probability_of_failure,
+                                          self.discount_factor, start)
+
+    def to_utility_matrix(self, q):
+        # Convert (action, row, col) utilities to the per-tile utility matrix
+        utility_matrix = np.full((self.maze.rows, self.maze.cols), None)
         for row in range(self.maze.rows):
             for col in range(self.maze.cols):
-                utility_history[(row, col)] = []
+                utility_matrix[row][col] = q[:, row, col].copy()
+        return utility_matrix
+
+    def q_grid(self, utility_matrix):
+        # Convert the per-tile utility matrix back to (action, row, col) utilities
+        return np.array(utility_matrix.tolist(), dtype=np.float64).transpose(2, 0, 1)
+
+    def cache_key(self, solver, **parameters):
+        # Key in a cache.SolutionCache of solving this maze with the agent's parameters and the given ones
+        start = (self.position_x, self.position_y) if self.reachable_only else None
+        return c.solution_key(self.maze, solver=solver, discount_factor=float(self.discount_factor),
+                              probability_of_success=float(self.probability_of_success),
+                              probability_of_failure=float(self.probability_of_failure),
+                              reward={tile: float(value) for tile, value in self.reward.items()}, start=start, **parameters)
+
+    def state_utilities(self, utility_matrix):
+        # Best utility of every tile of the per-tile utility matrix
+        return np.array([[max(utility_matrix[row][col]) for col in range(self.maze.cols)] for row in range(self.maze.rows)])
+
+    def initial_utility(self, iterations, epsilon, observer=None):
+        # Utility of every state solved on coarsened copies of the maze, to warm start the
+        # vectorized solvers. None if the maze is too small to coarsen
+        observer = observer if observer is not None else observers.NULL_OBSERVER
+        return multigrid.initial_utility(self.maze, self.reward, self.probability_of_success, self.probability_of_failure,
+                                         self.discount_factor, iterations, epsilon, observer=observer)
+
+    def value_iteration(self, iterations, epsilon, method='loop', history=None, workers=None, observer=None, warm_start=False,
+                        cache=None):
+        # epsilon is the maxmium allowed change in utility of any state in iteration
+        # method is 'loop' to back up one tile at a time, 'vectorized' to back up the whole grid at once,
+        # 'prioritized' to back up tiles in place in order of their Bellman error, or 'parallel'
+        # to back up bands of rows on `workers` processes (all cores by default)
+        # history is a recorder from history.py, by default every iteration is kept
+        # observer is an observer from observers.py that is sent a record of every iteration
+        # warm_start starts the vectorized method from utilities solved on coarsened mazes
+        # cache is a cache.SolutionCache to reuse earlier identical solves from, nothing is
+        # recorded in history when the solution comes from the cache
+        utility_history = history if history is not None else h.DictHistory(self.maze.rows, self.maze.cols)
+        observer = observer if observer is not None else observers.NULL_OBSERVER
+        if cache is not None:
+            key = self.cache_key('value', method=method, iterations=iterations, epsilon=epsilon, warm_start=warm_start)
+            solution = cache.get(key)
+            if solution is not None:
+                return self.to_utility_matrix(solution['q']), utility_history
+            utility_matrix, utility_history = self.value_iteration(iterations, epsilon, method, utility_history, workers, observer,
+                                                                   warm_start)
+            cache.put(key, q=self.q_grid(utility_matrix))
+            return utility_matrix, utility_history
+        if warm_start and method != 'vectorized':
+            raise ValueError("Invalid method, only vectorized value iteration can warm start")
+        if self.reachable_only and method not in ('vectorized', 'prioritized'):
+            raise ValueError("Invalid method, only vectorized and prioritized value iteration can solve reachable tiles only")
+        if method == 'vectorized':
+            initial = self.initial_utility(iterations, epsilon, observer) if warm_start else None
+            q = transition.value_iteration(self.transition_model(self.reachable_only), iterations, epsilon, utility_history,
+                                           observer, initial)
+            return self.to_utility_matrix(q), utility_history
+        elif method == 'parallel':
+            q = parallel.value_iteration(self.maze, self.reward, self.probability_of_success, self.probability_of_failure, self.discount_factor,
+                                         iterations, epsilon, utility_history, workers, observer=observer)
+            return self.to_utility_matrix(q), utility_history
+        elif method == 'prioritized':
+            q = sweeping.prioritized_value_iteration(self.transition_model(self.reachable_only), iterations, epsilon,
+                                                     utility_history, observer)
+            return self.to_utility_matrix(q), utility_history
+        elif method != 'loop':
+            raise ValueError("Invalid method")
+        utility_matrix = self.initalise_utility_matrix()
+        states = self.maze.rows * self.maze.cols - int(self.maze.walls.sum())
+        # Nested lists are much faster than the arrays to read one tile at a time
+        walls = self.maze.walls.tolist()
         for iteration in range(iterations):
-            new_matrix = utility_matrix.copy()
-            # delta is the actual change in utlity of any state
-            delta = 0
-            # Iterate through all states
-            for row in range(self.maze.rows):
-                for col in range(self.maze.cols):
-                    if self.maze.layout[row][col] == 'W':
-                        # Skip Value Iteration if tile is a wall
+            start = time.perf_counter()
+            with observer.span('sweep'):
+                new_matrix = utility_matrix.copy()
+                # delta is the actual change in utlity of any state
+                delta = 0
+                # Iterate through all states
+                for row in range(self.maze.rows):
+                    for col in range(self.maze.cols):
+                        if walls[row][col]:
+                            # Skip Value Iteration if tile is a wall
+                            for dir in range(len(CARDINAL_DIRECTIONS)):
+                                # Set all values to negative inf
+                                new_matrix[row][col][dir] = -np.inf
+                            continue
+                        state_utility = []
+                        possible_moves = self.get_possible_moves(row, col)
+                        # Calculate utility of all possible moves
+                        for action in CARDINAL_DIRECTIONS:
+                            utility = 0
+                            action_pos = CARDINAL_DIRECTIONS.index(action)
+                            # If the move is legal
+                            if action in possible_moves:
+                                # Calculate utility of the move
+                                reward = self.get_reward(row, col)
+                                # Calculate the next state utility if move is successful
+                                next_utility = self.get_next_utility(utility_matrix, row, col, action)
+                                utility += self.probability_of_success * max(next_utility)
+                                # Calculate the next state utility if move is unsuccessful
+                                next_utility = self.get_next_utility(utility_matrix, row, col, CARDINAL_DIRECTIONS[(action_pos + 1) % 4])
+                                utility += self.probability_of_failure * max(next_utility)
+                                next_utility =  self.get_next_utility(utility_matrix, row, col, CARDINAL_DIRECTIONS[(action_pos - 1) % 4])
+                                utility += self.probability_of_failure * max(next_utility)
+                                total = reward + (self.discount_factor * utility)
+                                state_utility.append(total)
+                            else:
+                                # Else set utility to 0
+                                state_utility.append(0)
                         for dir in range(len(CARDINAL_DIRECTIONS)):
-                            # Set all values to negative inf
-                            new_matrix[row][col][dir] = -np.inf
-                        continue
-                    state_utility = []
-                    possible_moves = self.get_possible_moves(row, col)
-                    # Calculate utility of all possible moves
-                    for action in CARDINAL_DIRECTIONS:
-                        utility = 0
-                        action_pos = CARDINAL_DIRECTIONS.index(action)
-                        # If the move is legal
-                        if action in possible_moves:
-                            # Calculate utility of the move
-                            reward = self.get_reward(row, col)
-                            # Calculate the next state utility if move is successful
-                            next_utility = self.get_next_utility(utility_matrix, row, col, action)
-                            utility += PROBABILITY_OF_SUCCESS * max(next_utility)
-                            # Calculate the next state utility if move is unsuccessful
-                            next_utility = self.get_next_utility(utility_matrix, row, col, CARDINAL_DIRECTIONS[(action_pos + 1) % 4])
-                            utility += PROBABILITY_OF_FAILURE * max(next_utility)
-                            next_utility =  self.get_next_utility(utility_matrix, row, col, CARDINAL_DIRECTIONS[(action_pos - 1) % 4])
-                            utility += PROBABILITY_OF_FAILURE * max(next_utility)
-                            total = reward + (DISCOUNT_FACTOR * utility)
-                            state_utility.append(total)
-                        else:
-                            # Else set utility to 0
-                            state_utility.append(0)
-                    for dir in range(len(CARDINAL_DIRECTIONS)):
-                        delta = max(delta, abs((new_matrix[row][col][dir]) - state_utility[dir]))
-                        new_matrix[row][col][dir] = state_utility[dir]
+                            delta = max(delta, abs((new_matrix[row][col][dir]) - state_utility[dir]))
+                            new_matrix[row][col][dir] = state_utility[dir]
             # Set the utility matrix to the new values
             utility_matrix[:] = new_matrix
             # Keep track of the utility matrix at every iteration
-            for row in range(self.maze.rows):
-                for col in range(self.maze.cols):
-                    utility_history[(row, col)].append(max(utility_matrix[row][col]))
+            utility_history.record(self.state_utilities(utility_matrix))
+            if observer.enabled:
+                observer.iteration({'solver': 'value_loop', 'iteration': iteration, 'seconds': time.perf_counter() - start,
+                                    'delta': float(delta), 'backups': states})
             if delta < epsilon:
                 print(f"Converged after {iteration} iterations. Delta: {delta}")
                 break
         return utility_matrix, utility_history
         
-    def policy_iteration(self, iterations, epsilon, one_iteration: bool):
+    def resolve(self, utility_matrix, changed_cells, iterations, epsilon, observer=None):
+        # Re-solve after the tiles at changed_cells (a list of (row, col)) were edited,
+        # starting from the utility matrix solved before the edit
+        model = self.transition_model()
+        observer = observer if observer is not None else observers.NULL_OBSERVER
+        state_utility = sweeping.resolve(model, self.state_utilities(utility_matrix), changed_cells, iterations, epsilon, observer)
+        return self.to_utility_matrix(model.to_grid(model.q_values(state_utility)))
+
+    def policy_iteration(self, iterations, epsilon, one_iteration: bool, method='loop', sweeps=20, history=None, observer=None,
+                         warm_start=False, cache=None):
+        # method is 'loop' to evaluate one tile at a time, 'linear' to evaluate each policy exactly
+        # with a sparse linear solve, or 'modified' to evaluate it with `sweeps` vectorized sweeps
+        # history is a recorder from history.py, by default every evaluation step is kept
+        # observer is an observer from observers.py that is sent a record of every iteration
+        # warm_start starts the linear and modified methods from utilities solved on coarsened mazes
+        # cache is a cache.SolutionCache to reuse earlier identical solves from
+        utility_history = history if history is not None else h.DictHistory(self.maze.rows, self.maze.cols)
+        observer = observer if observer is not None else observers.NULL_OBSERVER
+        if cache is not None:
+            key = self.cache_key('policy', method=method, iterations=iterations, epsilon=epsilon, one_iteration=one_iteration,
+                                 sweeps=sweeps, warm_start=warm_start)
+            solution = cache.get(key)
+            if solution is not None:
+                return self.to_utility_matrix(solution['q']), np.array(CARDINAL_DIRECTIONS)[solution['policy']], utility_history
+            utility_matrix, policy_map, utility_history = self.policy_iteration(iterations, epsilon, one_iteration, method, sweeps,
+                                                                                utility_history, observer, warm_start)
+            policy = np.array([CARDINAL_DIRECTIONS.index(action) for action in policy_map.ravel()], dtype=np.int8)
+            cache.put(key, q=self.q_grid(utility_matrix), policy=policy.reshape(policy_map.shape))
+            return utility_matrix, policy_map, utility_history
+        if (warm_start or self.reachable_only) and method not in ('linear', 'modified'):
+            raise ValueError("Invalid method, only linear and modified policy iteration can warm start or solve reachable tiles only")
+        if method in ('linear', 'modified'):
+            initial = self.initial_utility(iterations, epsilon, observer) if warm_start else None
+            q, policy = transition.policy_iteration(self.transition_model(self.reachable_only), iterations, epsilon, utility_history,
+                                                    method, sweeps, observer, initial)
+            policy_map = np.array(CARDINAL_DIRECTIONS)[policy]
+            return self.to_utility_matrix(q), policy_map, utility_history
+        elif method != 'loop':
+            raise ValueError("Invalid method")
         utility_matrix = self.initalise_utility_matrix()
         policy_map = self.initialise_policy_map()
-        utility_history = {}
-        for row in range(self.maze.rows):
-            for col in range(self.maze.cols):
-                utility_history[(row, col)] = []
+        states = self.maze.rows * self.maze.cols - int(self.maze.walls.sum())
+        # Nested lists are much faster than the arrays to read one tile at a time
+        walls, move_masks = self.maze.walls.tolist(), self.maze.move_mask.tolist()
         for iteration in range(iterations):
             policy_changed = False
+            policy_changes = 0
+            start = time.perf_counter()
             # Step 1: Policy Evaluation => Computing Utility of all states with policy's move
-            utility_matrix, policy_map, utility_history = self.policy_evaluation(epsilon, utility_matrix, policy_map, utility_history, one_iteration )
-                
+            with observer.span('evaluation'):
+                utility_matrix, policy_map, utility_history = self.policy_evaluation(epsilon, utility_matrix, policy_map, utility_history, one_iteration )
+            evaluated = time.perf_counter()
+
             # Step 2: Policy Improvement => Calculate new policy based on updated utilities
-            for row in range(self.maze.rows):
-                for col in range(self.maze.cols):
-                    if self.maze.layout[row][col] == 'W':
-                        continue
-                    # Get old action
-                    old_action = policy_map[row][col]
-                    old_action_pos = CARDINAL_DIRECTIONS.index(old_action)
-                    new_values = []
-                    possible_moves = self.get_possible_moves(row, col)
-                    # Check if new action dervies better value
-                    # than old action
-                    for action in CARDINAL_DIRECTIONS:
-                        action_pos = CARDINAL_DIRECTIONS.index(action)
-                        new_value = 0
-                        if action in possible_moves:
-                            reward = self.get_reward(row, col)
-                            new_value += PROBABILITY_OF_SUCCESS * self.get_q_value(utility_matrix, policy_map, row, col, action)
-                            failed_action_left_pos, failed_action_right_pos = (action_pos - 1) % 4, (action_pos + 1) % 4
-                            if self.check_move(CARDINAL_DIRECTIONS[failed_action_left_pos], row, col):
-                                new_value += PROBABILITY_OF_FAILURE * self.get_q_value(utility_matrix, policy_map, row, col, CARDINAL_DIRECTIONS[failed_action_left_pos])
-                            else:
-                                new_value += PROBABILITY_OF_FAILURE * utility_matrix[row][col][action_pos]
-                            if self.check_move(CARDINAL_DIRECTIONS[failed_action_right_pos], row, col):
-                                new_value += PROBABILITY_OF_FAILURE * self.get_q_value(utility_matrix, policy_map, row, col, CARDINAL_DIRECTIONS[failed_action_right_pos])
+            with observer.span('improvement'):
+                for row in range(self.maze.rows):
+                    for col in range(self.maze.cols):
+                        if walls[row][col] or not move_masks[row][col]:
+                            # Skip walls and tiles enclosed by walls
+                            continue
+                        # Get old action
+                        old_action = policy_map[row][col]
+                        old_action_pos = CARDINAL_DIRECTIONS.index(old_action)
+                        new_values = []
+                        possible_moves = self.get_possible_moves(row, col)
+                        # Check if new action dervies better value
+                        # than old action
+                        for action in CARDINAL_DIRECTIONS:
+                            action_pos = CARDINAL_DIRECTIONS.index(action)
+                            new_value = 0
+                            if action in possible_moves:
+                                reward = self.get_reward(row, col)
+                                new_value += self.probability_of_success * self.get_q_value(utility_matrix, policy_map, row, col, action)
+                                failed_action_left_pos, failed_action_right_pos = (action_pos - 1) % 4, (action_pos + 1) % 4
+                                if self.check_move(CARDINAL_DIRECTIONS[failed_action_left_pos], row, col):
+                                    new_value += self.probability_of_failure * self.get_q_value(utility_matrix, policy_map, row, col, CARDINAL_DIRECTIONS[failed_action_left_pos])
+                                else:
+                                    new_value += self.probability_of_failure * utility_matrix[row][col][action_pos]
+                                if self.check_move(CARDINAL_DIRECTIONS[failed_action_right_pos], row, col):
+                                    new_value += self.probability_of_failure * self.get_q_value(utility_matrix, policy_map, row, col, CARDINAL_DIRECTIONS[failed_action_right_pos])
+                                else:
+                                    new_value += self.probability_of_failure * utility_matrix[row][col][action_pos]
+                                new_value = reward + self.discount_factor * new_value
+                                new_values.append(new_value)
                             else:
-                                new_value += PROBABILITY_OF_FAILURE * utility_matrix[row][col][action_pos]
-                            new_value = reward + DISCOUNT_FACTOR * new_value
-                            new_values.append(new_value)
+                                new_values.append(-np.inf)
+                        # If new action better, update policy
+                        if utility_matrix[row][col][old_action_pos] < max(new_values):
+                            max_value_action_pos = np.argmax(new_values)
+                            policy_map[row][col] = CARDINAL_DIRECTIONS[max_value_action_pos]
+                        if policy_map[row][col] != old_action:
+                            policy_changed = True
+                            policy_changes += 1
                         else:
-                            new_values.append(-np.inf)
-                    # If new action better, update policy
-                    if utility_matrix[row][col][old_action_pos] < max(new_values):
-                        max_value_action_pos = np.argmax(new_values)
-                        policy_map[row][col] = CARDINAL_DIRECTIONS[max_value_action_pos]
-                    if policy_map[row][col] != old_action:
-                        policy_changed = True
-                    else:
-                        pass
+                            pass
+            if observer.enabled:
+                end = time.perf_counter()
+                observer.iteration({'solver': 'policy_loop', 'iteration': iteration, 'seconds': end - start,
+                                    'evaluation_seconds': evaluated - start, 'improvement_seconds': end - evaluated,
+                                    'delta': None, 'backups': states, 'policy_changes': policy_changes})
 
             if not policy_changed:
                 print(f"Converged after {iteration} iterations.")
@@ -239,6 +376,7 @@ class Agent:
             
     def policy_evaluation(self, epsilon, utility_matrix, policy_map, utility_history, one_iteration):
         # Policy Evaluation
+        walls, move_masks = self.maze.walls.tolist(), self.maze.move_mask.tolist()
         while True:
             new_matrix = utility_matrix.copy()
             delta = 0.0
@@ -247,38 +385,38 @@ class Agent:
                     # Go through the policy first
                     # This is the action the agent will take
                     action = policy_map[row][col]
-                    if self.maze.layout[row][col] == 'W':
+                    if walls[row][col]:
                             # Skip if current tile is a wall
                             for dir in range(len(CARDINAL_DIRECTIONS)):
                                 # Set all values to negative inf
                                 new_matrix[row][col][dir] = -np.inf
                             continue
+                    if not move_masks[row][col]:
+                        # Skip if current tile is enclosed by walls, it has no move to evaluate
+                        continue
                     action_pos = CARDINAL_DIRECTIONS.index(action)
                     old_value = new_matrix[row][col][action_pos]
                     new_value = 0
                     reward = self.get_reward(row, col)
                     # Get the Q value of the next state based on policy
-                    new_value += PROBABILITY_OF_SUCCESS * self.get_q_value(utility_matrix, policy_map, row, col, action)
+                    new_value += self.probability_of_success * self.get_q_value(utility_matrix, policy_map, row, col, action)
                     # If the move failed, calculate Q value of next state based on failed action
                     failed_action_left_pos, failed_action_right_pos = (action_pos - 1) % 4, (action_pos + 1) % 4
                     if self.check_move(CARDINAL_DIRECTIONS[failed_action_left_pos], row, col):
-                        new_value += PROBABILITY_OF_FAILURE * self.get_q_value(utility_matrix, policy_map, row, col, CARDINAL_DIRECTIONS[failed_action_left_pos])
+                        new_value += self.probability_of_failure * self.get_q_value(utility_matrix, policy_map, row, col, CARDINAL_DIRECTIONS[failed_action_left_pos])
                     else:
-                        new_value += PROBABILITY_OF_FAILURE * new_matrix[row][col][action_pos]
+                        new_value += self.probability_of_failure * new_matrix[row][col][action_pos]
                     if self.check_move(CARDINAL_DIRECTIONS[failed_action_right_pos], row, col):
-                        new_value += PROBABILITY_OF_FAILURE * self.get_q_value(utility_matrix, policy_map, row, col, CARDINAL_DIRECTIONS[failed_action_right_pos])
+                        new_value += self.probability_of_failure * self.get_q_value(utility_matrix, policy_map, row, col, CARDINAL_DIRECTIONS[failed_action_right_pos])
                     else:
-                        new_value += PROBABILITY_OF_FAILURE * new_matrix[row][col][action_pos]
-                    new_value = reward + (DISCOUNT_FACTOR * new_value)
+                        new_value += self.probability_of_failure * new_matrix[row][col][action_pos]
+                    new_value = reward + (self.discount_factor * new_value)
                     new_matrix[row][col][action_pos] = new_value
                     delta = max(delta, abs(old_value - new_value))
             utility_matrix[:] = new_matrix
             # Append utility of all states of this iteration to utility history
-            for row in range(self.maze.rows):
-                for col in range(self.maze.cols):
-                    action = policy_map[row][col]
-                    action_pos = CARDINAL_DIRECTIONS.index(action)
-                    utility_history[(row, col)].append(utility_matrix[row][col][action_pos])
+            utility_history.record([[utility_matrix[row][col][CARDINAL_DIRECTIONS.index(policy_map[row][col])]
+                                     for col in range(self.maze.cols)] for row in range(self.maze.rows)])
             if(delta < epsilon):
                 break
             if(one_iteration):
@@ -292,7 +430,7 @@ class Agent:
         next_state_action = policy_map[next_x][next_y]
         next_state = self.get_next_utility(utility_matrix, x, y, action)
         next_utility = next_state[CARDINAL_DIRECTIONS.index(next_state_action)]
-        new_value = DISCOUNT_FACTOR * next_utility
+        new_value = self.discount_factor * next_utility
         return new_value
 
     def determine_policy(self, utility_matrix):
@@ -308,13 +446,23 @@ class Agent:
                 value_map[row][col] = round(max(utility_matrix[row][col]),3)
         return policy, value_map
     
+    def rollout(self, policy_map, episodes, horizon, terminal_tiles=(), seed=None):
+        # Simulate `episodes` runs of the policy from the agent's position at once
+        # Runs end after `horizon` steps, or on reaching one of terminal_tiles
+        # Returns statistics of the discounted returns and of the episode lengths
+        model = self.transition_model()
+        policy = np.array([CARDINAL_DIRECTIONS.index(action) if action in CARDINAL_DIRECTIONS else 0
+                           for action in np.ravel(policy_map)], dtype=np.intp)
+        terminal = None
+        if terminal_tiles:
+            terminal = np.isin(self.maze.tiles, [map.TILE_CODES[tile] for tile in terminal_tiles]).ravel()
+        start = self.position_x * self.maze.cols + self.position_y
+        returns, lengths = rollout.simulate(model, policy, start, episodes, horizon, terminal, seed)
+        return rollout.summarise(returns, lengths)
+
     def determine_total_states(self):
-        # Calculate total number of states and actions
-        total_states = 0
-        total_actions = 0
-        for row in range(self.maze.rows):
-            for col in range(self.maze.cols):
-                if self.maze.layout[row][col] != 'W':
-                    total_states += 1
-                    total_actions += len(self.get_possible_moves(row, col))
-        return total_states, total_actions
\ No newline at end of file
+        # Calculate total number of states (non-wall tiles, or reachable tiles only if
+        # reachable_only) and of their possible moves
+        model = self.transition_model(self.reachable_only)
+        states = ~model.walls
+        return int(states.sum()), int(model.legal[:, states].sum())
\ No newline at end of file
@@ -0,0 +1,96 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+import map
+import agent as a
+import history as h
+import transition
+import cache as c
+
+SOLVERS = ('value', 'policy')
+
+
+def solve_layout(layout, solver='value', iterations=1000, epsilon=0.001, cache=None):
+    # Solve one (rows, cols, plan) layout with the vectorized solvers
+    # Returns the utility of every tile (-inf for walls) and the index in
+    # agent.CARDINAL_DIRECTIONS of its best action (-1 for walls)
+    # cache is a cache.SolutionCache, shared with Agent solves of the same layout and parameters
+    rows, cols, plan = layout
+    maze = map.Maze(rows, cols)
+    for x, y, node in plan:
+        maze.set_tile(x, y, node)
+    agent = a.Agent(maze)
+    if solver == 'value':
+        key = agent.cache_key('value', method='vectorized', iterations=iterations, epsilon=epsilon, warm_start=False)
+    elif solver == 'policy':
+        key = agent.cache_key('policy', method='linear', iterations=iterations, epsilon=epsilon, one_iteration=True, sweeps=20,
+                              warm_start=False)
+    else:
+        raise ValueError("Invalid solver")
+    solution = cache.get(key) if cache is not None else None
+    if solution is not None:
+        q = solution['q']
+    else:
+        model = agent.transition_model()
+        if solver == 'value':
+            q = transition.value_iteration(model, iterations, epsilon, h.NoHistory(rows, cols))
+            if cache is not None:
+                cache.put(key, q=q)
+        else:
+            q, policy = transition.policy_iteration(model, iterations, epsilon, h.NoHistory(rows, cols))
+            if cache is not None:
+                cache.put(key, q=q, policy=policy.astype(np.int8))
+    policy = np.where(maze.walls, -1, np.argmax(q, axis=0)).astype(np.int8)
+    return q.max(axis=0), policy
+
+
+def solve_batch(layouts, solver='value', iterations=1000, epsilon=0.001, workers=None, chunksize=1, cache=None):
+    # Solve many layouts across a process pool, results are in the same order as layouts
+    if solver not in SOLVERS:
+        raise ValueError("Invalid solver")
+    solve = partial(solve_layout, solver=solver, iterations=iterations, epsilon=epsilon, cache=cache)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(solve, layouts, chunksize=chunksize))
+
+
+def load_layouts(path):
+    # Layouts file is a JSON list of {"rows": ..., "cols": ..., "plan": [[x, y, tile], ...]}
+    with open(path) as file:
+        return [(layout['rows'], layout['cols'], [tuple(tile) for tile in layout['plan']]) for layout in json.load(file)]
+
+
+def save_results(path, results):
+    # Store the results of layout i as utilities_i and policy_i
+    arrays = {}
+    for i, (utilities, policy) in enumerate(results):
+        arrays[f"utilities_{i}"] = utilities
+        arrays[f"policy_{i}"] = policy
+    np.savez_compressed(path, **arrays)
+
+
+def add_arguments(parser):
+    parser.add_argument("layouts", help="JSON file of layouts")
+    parser.add_argument("output", help=".npz file to write the utilities and policies to")
+    parser.add_argument("--solver", choices=SOLVERS, default='value')
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--epsilon", type=float, default=0.001)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunksize", type=int, default=1)
+    parser.add_argument("--cache", help="directory of a solution cache to reuse earlier solves from")
+    parser.add_argument("--cache-size", type=int, default=c.DEFAULT_MAX_BYTES >> 20, help="size limit of the cache in MiB")
+
+
+def run(args):
+    cache = c.SolutionCache(args.cache, args.cache_size << 20) if args.cache else None
+    results = solve_batch(load_layouts(args.layouts), args.solver, args.iterations, args.epsilon, args.workers, args.chunksize, cache)
+    save_results(args.output, results)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solve many maze layouts in parallel")
+    add_arguments(parser)
+    run(parser.parse_args())
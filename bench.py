@@ -0,0 +1,148 @@
+import argparse
+import contextlib
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+import agent as a
+import generator
+import history as h
+
+DEFAULT_SIZES = (6, 25, 50, 100, 250, 500, 1000, 2000)
+
+# Solvers that back up one tile at a time in Python are only run on small mazes
+LOOP_SOLVERS = ('value_loop', 'policy_loop')
+LOOP_MAX_SIZE = 25
+
+# Solvers whose work is done in worker processes, which tracemalloc does not see, so their
+# peak memory is not measured
+PROCESS_SOLVERS = ('value_parallel',)
+
+SOLVERS = ('value_loop', 'value_vectorized', 'value_multigrid', 'value_parallel', 'policy_loop', 'policy_linear', 'policy_modified',
+           'determine_policy')
+
+
+def solver_run(solver, agent: a.Agent, iterations, epsilon):
+    # Function running one solve, with any setup it needs done up front
+    history = h.NoHistory(agent.maze.rows, agent.maze.cols)
+    if solver == 'value_loop':
+        return lambda: agent.value_iteration(iterations, epsilon, 'loop', history)
+    elif solver == 'value_vectorized':
+        return lambda: agent.value_iteration(iterations, epsilon, 'vectorized', history)
+    elif solver == 'value_multigrid':
+        return lambda: agent.value_iteration(iterations, epsilon, 'vectorized', history, warm_start=True)
+    elif solver == 'value_parallel':
+        return lambda: agent.value_iteration(iterations, epsilon, 'parallel', history)
+    elif solver == 'policy_loop':
+        return lambda: agent.policy_iteration(iterations, epsilon, True, 'loop', history=history)
+    elif solver == 'policy_linear':
+        return lambda: agent.policy_iteration(iterations, epsilon, True, 'linear', history=history)
+    elif solver == 'policy_modified':
+        return lambda: agent.policy_iteration(iterations, epsilon, True, 'modified', history=history)
+    elif solver == 'determine_policy':
+        utility_matrix, _ = agent.value_iteration(iterations, epsilon, 'vectorized', history)
+        return lambda: agent.determine_policy(utility_matrix)
+    else:
+        raise ValueError("Invalid solver")
+
+
+def measure(run, repeat, memory=True):
+    # Best wall time over `repeat` runs, then peak traced memory of one more run (None without memory)
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - start)
+    if not memory:
+        return min(seconds), None
+    tracemalloc.start()
+    run()
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(seconds), peak_bytes
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, solvers=SOLVERS, iterations=1000, epsilon=0.001, repeat=1, seed=0):
+    results = []
+    for size in sizes:
+        maze = generator.generate_maze(size, size, seed=seed)
+        agent = a.Agent(maze, *generator.start_position(maze))
+        for solver in solvers:
+            if solver in LOOP_SOLVERS and size > LOOP_MAX_SIZE:
+                continue
+            # The solvers report their progress on stdout, which is kept for the JSON report
+            with contextlib.redirect_stdout(sys.stderr):
+                seconds, peak_bytes = measure(solver_run(solver, agent, iterations, epsilon), repeat,
+                                              solver not in PROCESS_SOLVERS)
+            results.append({
+                'solver': solver,
+                'rows': size,
+                'cols': size,
+                'states': int((~maze.walls).sum()),
+                'seconds': seconds,
+                'peak_bytes': peak_bytes,
+            })
+            peak = 'not measured' if peak_bytes is None else f"{peak_bytes / 2**20:.1f} MiB"
+            print(f"{solver} {size}x{size}: {seconds:.4f}s, peak {peak}", file=sys.stderr)
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'iterations': iterations,
+        'epsilon': epsilon,
+        'seed': seed,
+        'results': results,
+    }
+
+
+def compare_results(baseline, current, tolerance=1.25):
+    # Runs of current that are more than `tolerance` times slower or larger than the same run of baseline
+    previous = {(result['solver'], result['rows'], result['cols']): result for result in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        old = previous.get((result['solver'], result['rows'], result['cols']))
+        if old is None:
+            continue
+        for metric in ('seconds', 'peak_bytes'):
+            if result[metric] is None or old[metric] is None:
+                continue
+            if result[metric] > tolerance * old[metric]:
+                regressions.append((result['solver'], result['rows'], result['cols'], metric, old[metric], result[metric]))
+    return regressions
+
+
+def add_arguments(parser):
+    parser.add_argument("--sizes", type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument("--solvers", choices=SOLVERS, nargs='+', default=SOLVERS)
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--epsilon", type=float, default=0.001)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON file to write the results to")
+    parser.add_argument("--baseline", help="JSON results of a previous run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=1.25)
+
+
+def run(args):
+    # Returns the exit status, 1 if there are regressions from the baseline
+    report = run_benchmarks(args.sizes, args.solvers, args.iterations, args.epsilon, args.repeat, args.seed)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare_results(json.load(file), report, args.tolerance)
+        for solver, rows, cols, metric, old, new in regressions:
+            print(f"Regression in {solver} {rows}x{cols} {metric}: {old} -> {new}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time and memory-profile the solvers on random mazes")
+    add_arguments(parser)
+    sys.exit(run(parser.parse_args()))
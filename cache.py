@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+import numpy as np
+import map
+
+# On-disk cache of solved mazes. Each solution is one uncompressed .npz file named by a hash
+# of the maze tiles and the solver parameters, so identical solves share one file across runs
+# and processes. Files are written to a temporary file and renamed into place, so readers
+# never see a partly written solution and concurrent writers of the same key just replace
+# each other's identical result. Reading a solution touches its modification time, and the
+# least recently used files are removed when the cache grows beyond its size limit
+
+DEFAULT_MAX_BYTES = 1 << 30
+
+
+def solution_key(maze: map.Maze, **parameters):
+    # Hash of the tiles of a maze and of the JSON-serialisable parameters of its solve
+    digest = hashlib.sha256()
+    digest.update(np.array(maze.tiles.shape, dtype=np.int64).tobytes())
+    digest.update(np.ascontiguousarray(maze.tiles).tobytes())
+    digest.update(json.dumps(parameters, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class SolutionCache:
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def get(self, key):
+        # The arrays stored under key as a dictionary, or None if they are not in the cache
+        path = self.path(key)
+        try:
+            with np.load(path) as solution:
+                arrays = {name: solution[name] for name in solution.files}
+            os.utime(path)
+        except (FileNotFoundError, EOFError, zipfile.BadZipFile):
+            # Not solved yet, removed by another process in the meantime, or damaged (and
+            # then replaced by the next put)
+            return None
+        return arrays
+
+    def put(self, key, **arrays):
+        # Store the arrays under key, then evict down to the size limit
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                np.savez(file, **arrays)
+            os.replace(temporary, self.path(key))
+        except BaseException:
+            os.remove(temporary)
+            raise
+        self.evict()
+
+    def evict(self):
+        # Remove the least recently used solutions until the cache fits in max_bytes
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if not entry.name.endswith('.npz'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Already evicted by another process
+                pass
+            total -= size
@@ -0,0 +1,28 @@
+import numpy as np
+import map
+
+
+def generate_maze(rows, cols, wall_density=0.2, good_density=0.05, bad_density=0.05, seed=None):
+    # Random maze where each tile is independently a wall, G or B with the given densities
+    # and N otherwise, plus one S on a random non-wall tile. The same seed gives the same maze
+    if wall_density + good_density + bad_density > 1:
+        raise ValueError("Densities must add up to at most 1")
+    rng = np.random.default_rng(seed)
+    maze = map.Maze(rows, cols)
+    draw = rng.random((rows, cols))
+    bounds = np.cumsum([wall_density, good_density, bad_density])
+    tiles = np.array([map.TILE_CODES[tile] for tile in ('W', 'G', 'B', 'N')], dtype=np.uint8)
+    maze.tiles[:] = tiles[np.searchsorted(bounds, draw, side='right')]
+    open_tiles = np.flatnonzero(~maze.walls)
+    if len(open_tiles):
+        maze.tiles.flat[rng.choice(open_tiles)] = map.TILE_CODES['S']
+    maze.invalidate()
+    return maze
+
+
+def start_position(maze: map.Maze):
+    # Coordinates of the S tile, or of the first non-wall tile if there is none
+    starts = np.argwhere(maze.tiles == map.TILE_CODES['S'])
+    if not len(starts):
+        starts = np.argwhere(~maze.walls)
+    return tuple(int(coordinate) for coordinate in starts[0])
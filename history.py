@@ -0,0 +1,146 @@
+import numpy as np
+
+# Recorders for the utility of every tile over the iterations of a solver.
+# Each recorder is given a (rows, cols) grid of utilities per iteration through record(),
+# and exposes what it kept through iterations (the recorded iteration numbers)
+# and as_array() (the recorded utilities as a (recorded, rows, cols) array)
+
+
+class DictHistory(dict):
+    # Keep every iteration as {(row, col): [utility, ...]}
+    def __init__(self, rows, cols):
+        super().__init__(((row, col), []) for row in range(rows) for col in range(cols))
+        self.rows = rows
+        self.cols = cols
+
+    def record(self, utilities):
+        for (row, col), values in self.items():
+            values.append(float(utilities[row][col]))
+
+    @property
+    def iterations(self):
+        return np.arange(len(self[(0, 0)]) if self else 0)
+
+    def as_array(self):
+        return np.array(list(self.values()), dtype=np.float64).T.reshape(-1, self.rows, self.cols)
+
+
+class NoHistory:
+    # Keep nothing
+    def __init__(self, rows, cols):
+        self.rows = rows
+        self.cols = cols
+
+    def record(self, utilities):
+        pass
+
+    @property
+    def iterations(self):
+        return np.arange(0)
+
+    def as_array(self):
+        return np.empty((0, self.rows, self.cols), dtype=np.float32)
+
+
+class SampledHistory:
+    # Keep one iteration out of every `every` iterations
+    def __init__(self, rows, cols, every):
+        self.rows = rows
+        self.cols = cols
+        self.every = every
+        self.iteration = 0
+        self.recorded_iterations = []
+        self.samples = []
+
+    def record(self, utilities):
+        if self.iteration % self.every == 0:
+            self.recorded_iterations.append(self.iteration)
+            self.samples.append(np.array(utilities, dtype=np.float32))
+        self.iteration += 1
+
+    @property
+    def iterations(self):
+        return np.array(self.recorded_iterations, dtype=np.int64)
+
+    def as_array(self):
+        if not self.samples:
+            return np.empty((0, self.rows, self.cols), dtype=np.float32)
+        return np.stack(self.samples)
+
+
+class ArrayHistory:
+    # Keep at most `capacity` iterations in a preallocated float32 array, or in a
+    # memory-mapped file at `path`. When the array is full, every other sample is
+    # dropped and the sampling interval doubles, so the whole run stays covered
+    def __init__(self, rows, cols, capacity, path=None):
+        if capacity < 2:
+            raise ValueError("Capacity must be at least 2")
+        self.rows = rows
+        self.cols = cols
+        self.capacity = capacity
+        if path is None:
+            self.buffer = np.empty((capacity, rows, cols), dtype=np.float32)
+        else:
+            self.buffer = np.memmap(path, dtype=np.float32, mode='w+', shape=(capacity, rows, cols))
+        self.recorded_iterations = np.empty(capacity, dtype=np.int64)
+        self.count = 0
+        self.every = 1
+        self.iteration = 0
+
+    def record(self, utilities):
+        if self.iteration % self.every == 0 and self.count == self.capacity:
+            self.downsample()
+        if self.iteration % self.every == 0:
+            self.buffer[self.count] = utilities
+            self.recorded_iterations[self.count] = self.iteration
+            self.count += 1
+        self.iteration += 1
+
+    def downsample(self):
+        # Keep samples 0, 2, 4, ... in place, moving one sample at a time so no copy of the buffer is made
+        kept = (self.count + 1) // 2
+        for sample in range(1, kept):
+            self.buffer[sample] = self.buffer[2 * sample]
+            self.recorded_iterations[sample] = self.recorded_iterations[2 * sample]
+        self.count = kept
+        self.every *= 2
+
+    @property
+    def iterations(self):
+        return self.recorded_iterations[:self.count]
+
+    def as_array(self):
+        return self.buffer[:self.count]
+
+
+class StoredHistory:
+    # Read-only history from arrays saved by an earlier run
+    def __init__(self, iterations, utilities):
+        self.recorded_iterations = np.asarray(iterations)
+        self.utilities = utilities
+        self.rows, self.cols = utilities.shape[1:]
+
+    def record(self, utilities):
+        raise TypeError("Stored history is read-only")
+
+    @property
+    def iterations(self):
+        return self.recorded_iterations
+
+    def as_array(self):
+        return self.utilities
+
+
+def create_history(rows, cols, mode='all', every=1, capacity=1000, path=None):
+    # mode is 'all' to keep every iteration, 'off' to keep nothing, 'sampled' to keep
+    # every `every` iterations, or 'array' to keep at most `capacity` iterations
+    if mode == 'all':
+        return DictHistory(rows, cols)
+    elif mode == 'off':
+        return NoHistory(rows, cols)
+    elif mode == 'sampled':
+        return SampledHistory(rows, cols, every)
+    elif mode == 'array':
+        return ArrayHistory(rows, cols, capacity, path)
+    else:
+        raise ValueError("Invalid history mode")
@@ -1,7 +1,12 @@
-import matplotlib.pyplot as plt
+import argparse
+import json
+import sys
 import numpy as np
 import map
 import agent as a
+import history as h
+import cache as c
+# matplotlib and render are only imported when plotting, so solving starts without them
 # Layout given by assignment
 # G = +1
 # W = wall
@@ -64,8 +69,24 @@ EXTRA_LAYOUT = [
     (4, 4, 'S'),
     
 ]
+LAYOUTS = {
+    'assignment': (6, 6, ASSIGNMENT_LAYOUT),
+    'extra': (7, 9, EXTRA_LAYOUT),
+}
+VALUE_METHODS = ('loop', 'vectorized', 'parallel', 'prioritized')
+POLICY_METHODS = ('loop', 'linear', 'modified')
+# Methods of either solver that can solve only the tiles reachable from the start
+REACHABLE_METHODS = ('vectorized', 'prioritized', 'linear', 'modified')
+# Methods of either solver that can warm start from utilities solved on coarsened mazes
+WARM_START_METHODS = ('vectorized', 'linear', 'modified')
 
-def plot_policy(agent: a.Agent, policy_map, value_map, title):
+def plot_policy(agent: a.Agent, policy_map, value_map, title, path=None):
+    if path is not None:
+        # Render headless to an image file instead, for large mazes
+        import render
+        render.render_policy(agent.maze, policy_map, value_map, title, path)
+        return
+    import matplotlib.pyplot as plt
     arrow_map = {
         'North': '↑',  
         'South': '↓',  
@@ -102,11 +123,18 @@ def plot_policy(agent: a.Agent, policy_map, value_map, title):
     plt.title(title)
     plt.show()
 
-def plot_history(utility_history, agent, title):
-    for (row, col), utilities in utility_history.items():
-        if agent.maze.layout[row][col] == 'W':
-            continue
-        plt.plot(range(len(utilities)), utilities, label=f"({row},{col})", alpha=0.5)
+def plot_history(utility_history, agent, title, path=None, sample=0):
+    # utility_history is a recorder from history.py
+    if path is not None:
+        # Render aggregates over all tiles to an image file instead, for large mazes
+        import render
+        render.render_history(utility_history, agent.maze, title, path, sample)
+        return
+    import matplotlib.pyplot as plt
+    iterations = utility_history.iterations
+    utilities = utility_history.as_array()
+    for row, col in zip(*np.nonzero(~agent.maze.walls)):
+        plt.plot(iterations, utilities[:, row, col], label=f"({row},{col})", alpha=0.5)
 
     # Graph formatting
     plt.xlabel("Iteration")
@@ -117,24 +145,171 @@ def plot_history(utility_history, agent, title):
     plt.show()
                 
 
-# Initialize the map layout
-assignment_map = map.create_layout_from_list(6, 6, ASSIGNMENT_LAYOUT)
-assignment_map.display()
-
-# Init Extra Map 
-extra_map = map.create_layout_from_list(7, 9, EXTRA_LAYOUT)
-extra_map.display()
-
-# Value Iteration Agent
-value_iter_agent = a.Agent(extra_map,3,2)
-value_u_map, value_u_history = value_iter_agent.value_iteration(1000,0.001)
-value_p_map, value_value_map = value_iter_agent.determine_policy(value_u_map)
-plot_policy(value_iter_agent, value_p_map, value_value_map, "Optimal Policy Map for Value iteration")
-plot_history(value_u_history, value_iter_agent, "Utility Value History for Value Iteration")
-print(value_iter_agent.determine_total_states())
-# Policy Iteration Agent
-policy_iter_agent = a.Agent(extra_map,3,2)
-policy_u_map, policy_p_map, policy_u_history = policy_iter_agent.policy_iteration(1000, 0.001, True)
-policy_p_map , policy_value_map = policy_iter_agent.determine_policy(policy_u_map)
-plot_policy(policy_iter_agent, policy_p_map, policy_value_map, "Optimal Policy Map for Policy Iteration")
-plot_history(policy_u_history, policy_iter_agent, "Utility Value History for Policy Iteration") 
\ No newline at end of file
+def load_maze(source, rows=None, cols=None):
+    # source is the name of a layout in LAYOUTS, a .json layout file of
+    # {"rows": ..., "cols": ..., "plan": [[x, y, tile], ...]}, a .npy maze file from mazefile.save_maze,
+    # or a text file of "x y tile" lines, which needs rows and cols
+    if source in LAYOUTS:
+        return map.create_layout_from_list(*LAYOUTS[source])
+    if source.endswith('.json'):
+        with open(source) as file:
+            layout = json.load(file)
+        return map.create_layout_from_list(layout['rows'], layout['cols'], [tuple(tile) for tile in layout['plan']])
+    import mazefile
+    if source.endswith('.npy'):
+        return mazefile.load_maze(source)
+    if rows is None or cols is None:
+        raise ValueError("Invalid maze, text files need --rows and --cols")
+    return mazefile.load_sparse_text(source, rows, cols)
+
+
+def solve(args):
+    maze = load_maze(args.maze, args.rows, args.cols)
+    agent = a.Agent(maze, *args.start, discount_factor=args.discount_factor,
+                    probability_of_success=1 - 2 * args.slip, probability_of_failure=args.slip, reachable_only=args.reachable_only)
+    history = h.create_history(maze.rows, maze.cols, args.history, args.every, args.capacity)
+    cache = c.SolutionCache(args.cache, args.cache_size << 20) if args.cache else None
+    if args.solver == 'value':
+        method = args.method or 'vectorized'
+        if method not in VALUE_METHODS:
+            raise ValueError("Invalid method")
+        utility_matrix, history = agent.value_iteration(args.iterations, args.epsilon, method, history, args.workers,
+                                                       warm_start=args.warm_start, cache=cache)
+    else:
+        method = args.method or 'linear'
+        if method not in POLICY_METHODS:
+            raise ValueError("Invalid method")
+        utility_matrix, _, history = agent.policy_iteration(args.iterations, args.epsilon, True, method, args.sweeps, history,
+                                                           warm_start=args.warm_start, cache=cache)
+    # Same arrays as batch.solve_layout, utilities are -inf and policies -1 on walls (and unsolved tiles)
+    utilities = agent.state_utilities(utility_matrix)
+    policy = np.array([[np.argmax(utility_matrix[row][col]) for col in range(maze.cols)] for row in range(maze.rows)])
+    policy = np.where(np.isneginf(utilities), -1, policy).astype(np.int8)
+    np.savez_compressed(args.output, utilities=utilities, policy=policy,
+                        history_iterations=history.iterations, history_utilities=history.as_array())
+    return 0
+
+
+def render_results(args):
+    import render
+    maze = load_maze(args.maze, args.rows, args.cols)
+    with np.load(args.results) as results:
+        utilities, policy = results['utilities'], results['policy']
+        history = h.StoredHistory(results['history_iterations'], results['history_utilities'])
+    title = args.title or args.maze
+    if args.policy_image:
+        value_map = np.round(utilities, 3) if maze.rows * maze.cols <= render.LABEL_LIMIT else None
+        render.render_policy(maze, policy, value_map, f"Optimal Policy Map for {title}", args.policy_image)
+    if args.history_image:
+        render.render_history(history, maze, f"Utility Value History for {title}", args.history_image, args.sample)
+    return 0
+
+
+def demo(args):
+    # Initialize the map layout
+    assignment_map = map.create_layout_from_list(6, 6, ASSIGNMENT_LAYOUT)
+    assignment_map.display()
+
+    # Init Extra Map 
+    extra_map = map.create_layout_from_list(7, 9, EXTRA_LAYOUT)
+    extra_map.display()
+
+    # Value Iteration Agent
+    value_iter_agent = a.Agent(extra_map,3,2)
+    value_u_map, value_u_history = value_iter_agent.value_iteration(1000,0.001)
+    value_p_map, value_value_map = value_iter_agent.determine_policy(value_u_map)
+    plot_policy(value_iter_agent, value_p_map, value_value_map, "Optimal Policy Map for Value iteration")
+    plot_history(value_u_history, value_iter_agent, "Utility Value History for Value Iteration")
+    print(value_iter_agent.determine_total_states())
+    # Policy Iteration Agent
+    policy_iter_agent = a.Agent(extra_map,3,2)
+    policy_u_map, policy_p_map, policy_u_history = policy_iter_agent.policy_iteration(1000, 0.001, True)
+    policy_p_map , policy_value_map = policy_iter_agent.determine_policy(policy_u_map)
+    plot_policy(policy_iter_agent, policy_p_map, policy_value_map, "Optimal Policy Map for Policy Iteration")
+    plot_history(policy_u_history, policy_iter_agent, "Utility Value History for Policy Iteration")
+    return 0
+
+
+def add_maze_arguments(parser):
+    parser.add_argument("maze", help=f"layout name ({', '.join(LAYOUTS)}), .json layout, .npy maze or text maze file")
+    parser.add_argument("--rows", type=int, help="rows of a text maze file")
+    parser.add_argument("--cols", type=int, help="columns of a text maze file")
+
+
+def build_parser():
+    # bench and batch take their arguments and run from their own modules
+    import bench
+    import batch
+    parser = argparse.ArgumentParser(description="Solve grid world mazes with value and policy iteration")
+    commands = parser.add_subparsers(dest='command')
+
+    parser_solve = commands.add_parser('solve', help="solve a maze and save its utilities and policy to a .npz file")
+    add_maze_arguments(parser_solve)
+    parser_solve.add_argument("output", help=".npz file to write the utilities, policy and history to")
+    parser_solve.add_argument("--solver", choices=('value', 'policy'), default='value')
+    parser_solve.add_argument("--method", choices=sorted(set(VALUE_METHODS + POLICY_METHODS)),
+                              help="vectorized for value iteration and linear for policy iteration by default")
+    parser_solve.add_argument("--iterations", type=int, default=1000)
+    parser_solve.add_argument("--epsilon", type=float, default=0.001)
+    parser_solve.add_argument("--sweeps", type=int, default=20, help="evaluation sweeps of modified policy iteration")
+    parser_solve.add_argument("--workers", type=int, help="processes of parallel value iteration")
+    parser_solve.add_argument("--cache", help="directory of a solution cache to reuse earlier solves from")
+    parser_solve.add_argument("--cache-size", type=int, default=c.DEFAULT_MAX_BYTES >> 20, help="size limit of the cache in MiB")
+    parser_solve.add_argument("--warm-start", action='store_true',
+                              help="start from utilities solved on coarsened mazes (vectorized, linear and modified methods)")
+    parser_solve.add_argument("--reachable-only", action='store_true',
+                              help="solve only the tiles reachable from --start, the others are saved like walls")
+    parser_solve.add_argument("--discount-factor", type=float, default=a.DISCOUNT_FACTOR)
+    parser_solve.add_argument("--slip", type=float, default=a.PROBABILITY_OF_FAILURE,
+                              help="probability of moving to each side of the intended direction")
+    parser_solve.add_argument("--start", type=int, nargs=2, default=(0, 0), metavar=('ROW', 'COL'))
+    parser_solve.add_argument("--history", choices=('off', 'all', 'sampled', 'array'), default='off')
+    parser_solve.add_argument("--every", type=int, default=1, help="iterations between samples of sampled history")
+    parser_solve.add_argument("--capacity", type=int, default=1000, help="most iterations kept by array history")
+    parser_solve.set_defaults(run=solve)
+
+    parser_render = commands.add_parser('render', help="render the results of solve to image files")
+    add_maze_arguments(parser_render)
+    parser_render.add_argument("results", help=".npz file written by solve")
+    parser_render.add_argument("--policy-image", help="image file to draw the policy to")
+    parser_render.add_argument("--history-image", help="image file to draw the utility history to")
+    parser_render.add_argument("--title")
+    parser_render.add_argument("--sample", type=int, default=0, help="random tiles to plot in the history")
+    parser_render.set_defaults(run=render_results)
+
+    parser_bench = commands.add_parser('bench', help="time and memory-profile the solvers on random mazes")
+    bench.add_arguments(parser_bench)
+    parser_bench.set_defaults(run=bench.run)
+
+    parser_batch = commands.add_parser('batch', help="solve many maze layouts in parallel")
+    batch.add_arguments(parser_batch)
+    parser_batch.set_defaults(run=batch.run)
+
+    commands.add_parser('demo', help="solve and plot the assignment mazes (the default)").set_defaults(run=demo)
+    return parser
+
+
+def check_solve_arguments(args):
+    # Error message for solve arguments that argparse cannot check on its own, or None
+    methods = VALUE_METHODS if args.solver == 'value' else POLICY_METHODS
+    if args.method is not None and args.method not in methods:
+        return f"--method {args.method} is not a method of the {args.solver} solver (choose from {', '.join(methods)})"
+    if args.reachable_only and args.method is not None and args.method not in REACHABLE_METHODS:
+        return (f"--reachable-only is not supported by the {args.method} method "
+                f"(use one of {', '.join(method for method in methods if method in REACHABLE_METHODS)})")
+    if args.warm_start and args.method is not None and args.method not in WARM_START_METHODS:
+        return (f"--warm-start is not supported by the {args.method} method "
+                f"(use one of {', '.join(method for method in methods if method in WARM_START_METHODS)})")
+    if not 0 <= args.slip <= 0.5:
+        return f"--slip must be between 0 and 0.5, got {args.slip}"
+    return None
+
+
+if __name__ == "__main__":
+    parser = build_parser()
+    args = parser.parse_args()
+    if args.command == 'solve':
+        error = check_solve_arguments(args)
+        if error:
+            parser.error(error)
+    sys.exit(getattr(args, 'run', demo)(args))
@@ -1,13 +1,111 @@
+import numpy as np
+
+# Tile types, stored in the maze as their index in this tuple
+TILES = ('N', 'S', 'W', 'G', 'B')
+TILE_CODES = {tile: code for code, tile in enumerate(TILES)}
+WALL = TILE_CODES['W']
+
+# Row/col offset of each move, in the same order as agent.CARDINAL_DIRECTIONS
+# (North, East, South, West). Bit i of the move mask is set if move i is legal
+MOVE_OFFSETS = ((-1, 0), (0, 1), (1, 0), (0, -1))
+
+
 class Maze:
-    # Initialize Map with 0s
-    def __init__(self, rows, cols):
+    # Initialize Map with 'N' tiles, or on an existing (rows, cols) uint8 array of tile codes without copying it
+    def __init__(self, rows, cols, tiles=None):
         self.rows = rows
         self.cols = cols
-        self.layout = [['N' for _ in range(cols)] for _ in range(rows)]
+        if tiles is None:
+            tiles = np.full((rows, cols), TILE_CODES['N'], dtype=np.uint8)
+        elif tiles.shape != (rows, cols) or tiles.dtype != np.uint8:
+            raise ValueError("Tiles must be a uint8 array of shape (rows, cols)")
+        self.tiles = tiles
+        self.invalidate()
+
+    @property
+    def layout(self):
+        # Tile characters of the map, indexed as layout[x][y]
+        return Layout(self)
+
+    def set_tile(self, x, y, tile):
+        if tile not in TILE_CODES:
+            raise ValueError("Invalid tile")
+        self.tiles[x, y] = TILE_CODES[tile]
+        self.invalidate()
+
+    def invalidate(self):
+        # Drop the arrays derived from the tiles, they are rebuilt on next use
+        # Call this after writing to tiles directly
+        self._move_mask = None
+        self._reward_grids = {}
+
+    @property
+    def walls(self):
+        return self.tiles == WALL
+
+    @property
+    def move_mask(self):
+        # 4-bit mask of the legal moves of every tile
+        if self._move_mask is None:
+            walls = self.walls
+            move_mask = np.zeros((self.rows, self.cols), dtype=np.uint8)
+            for bit, (d_row, d_col) in enumerate(MOVE_OFFSETS):
+                # Moving out of bounds acts like hitting a wall
+                open_target = np.zeros((self.rows, self.cols), dtype=bool)
+                open_target[max(0, -d_row):self.rows - max(0, d_row), max(0, -d_col):self.cols - max(0, d_col)] = \
+                    ~walls[max(0, d_row):self.rows + min(0, d_row), max(0, d_col):self.cols + min(0, d_col)]
+                move_mask |= open_target.astype(np.uint8) << bit
+            self._move_mask = move_mask
+        return self._move_mask
+
+    def reward_grid(self, reward):
+        # Reward of every tile from a {tile: reward} dictionary
+        key = tuple(reward[tile] for tile in TILES)
+        if key not in self._reward_grids:
+            self._reward_grids[key] = np.array(key, dtype=np.float64)[self.tiles]
+        return self._reward_grids[key]
 
     def display(self):
         for row in self.layout:
-            print(" ".join(map(str, row)))
+            print(" ".join(row))
+
+
+class Layout:
+    # Row view of the tile grid of a maze
+    def __init__(self, maze):
+        self.maze = maze
+
+    def __len__(self):
+        return self.maze.rows
+
+    def __getitem__(self, x):
+        if not -self.maze.rows <= x < self.maze.rows:
+            raise IndexError("Row out of range")
+        return LayoutRow(self.maze, x)
+
+    def __iter__(self):
+        for x in range(self.maze.rows):
+            yield LayoutRow(self.maze, x)
+
+
+class LayoutRow:
+    # Tile characters of one row of a maze
+    def __init__(self, maze, x):
+        self.maze = maze
+        self.x = x
+
+    def __len__(self):
+        return self.maze.cols
+
+    def __getitem__(self, y):
+        return TILES[self.maze.tiles.item(self.x, y)]
+
+    def __setitem__(self, y, tile):
+        self.maze.set_tile(self.x, y, tile)
+
+    def __iter__(self):
+        for code in self.maze.tiles[self.x].tolist():
+            yield TILES[code]
 
 
 def create_layout_with_input(row,col):
@@ -22,18 +120,18 @@ def create_layout_with_input(row,col):
         coord_input = input("Enter the Coordinates (0-indexed): ")
         x, y = map(int, coord_input.split())
         # Set the node type:
-        layout.layout[x][y] = user_input
+        layout.set_tile(x, y, user_input)
     return layout
     
 def create_layout_from_list(row, col, plan):
     print("Initializing the map layout")
     layout = Maze(row,col)
     for x,y,node in plan:
-        layout.layout[x][y] = node
+        layout.set_tile(x, y, node)
 
     return layout
 
 if __name__ == "__main__":
     rows, cols = 5, 5  # Define the size of the map
     map_layout = Maze(rows, cols)
-    map_layout.display()
\ No newline at end of file
+    map_layout.display()
@@ -0,0 +1,67 @@
+from itertools import islice
+import numpy as np
+import map
+
+# Mazes are stored on disk as .npy files of the (rows, cols) uint8 tile codes of map.TILES
+
+
+def save_maze(maze: map.Maze, path):
+    np.save(path, maze.tiles)
+
+
+def load_maze(path, mode='r'):
+    # Memory-map a maze saved with save_maze, the maze reads its tiles straight from the file
+    # mode is 'r' for read-only, 'r+' to write tile changes back to the file, or 'c' for copy-on-write
+    tiles = np.load(path, mmap_mode=mode)
+    if tiles.ndim != 2 or tiles.dtype != np.uint8:
+        raise ValueError("Maze file must hold a 2D uint8 array")
+    return map.Maze(*tiles.shape, tiles=tiles)
+
+
+def load_sparse_text(path, rows, cols, output=None, chunk_size=1000000):
+    # Build a maze from a text file of "x y tile" lines, read chunk_size lines at a time
+    # Tiles not in the file are 'N'. If output is given the maze is written to that .npy file
+    # as it is built, and is memory-mapped from it
+    if output is None:
+        tiles = np.full((rows, cols), map.TILE_CODES['N'], dtype=np.uint8)
+    else:
+        tiles = np.lib.format.open_memmap(output, mode='w+', dtype=np.uint8, shape=(rows, cols))
+        tiles[:] = map.TILE_CODES['N']
+    with open(path) as file:
+        while True:
+            chunk = list(islice(file, chunk_size))
+            if not chunk:
+                break
+            # A chunk of only blank lines is skipped, the file only ends with an empty chunk
+            lines = [line for line in chunk if line.strip()]
+            if not lines:
+                continue
+            fields = [line.split() for line in lines]
+            if any(len(line) != 3 for line in fields):
+                raise ValueError("Each line must be 'x y tile'")
+            fields = np.array(fields)
+            names, tile = np.unique(fields[:, 2], return_inverse=True)
+            if not set(names) <= set(map.TILES):
+                raise ValueError("Invalid tile")
+            try:
+                x, y = fields[:, 0].astype(np.intp), fields[:, 1].astype(np.intp)
+            except ValueError:
+                raise ValueError("Invalid coordinates, x and y must be integers")
+            # Checked before writing, negative coordinates would otherwise wrap around
+            if ((x < 0) | (x >= rows) | (y < 0) | (y >= cols)).any():
+                raise ValueError("Invalid coordinates, x must be in [0, rows) and y in [0, cols)")
+            codes = np.array([map.TILE_CODES[name] for name in names], dtype=np.uint8)
+            tiles[x, y] = codes[tile]
+    if output is not None:
+        tiles.flush()
+    return map.Maze(rows, cols, tiles=tiles)
+
+
+def save_sparse_text(maze: map.Maze, path, chunk_size=1000000):
+    # Write the non-'N' tiles of a maze as "x y tile" lines, about chunk_size tiles at a time
+    block_rows = max(1, chunk_size // max(1, maze.cols))
+    with open(path, 'w') as file:
+        for start in range(0, maze.rows, block_rows):
+            block = maze.tiles[start:start + block_rows]
+            x, y = np.nonzero(block != map.TILE_CODES['N'])
+            file.writelines(f"{start + row} {col} {map.TILES[block[row, col]]}\n" for row, col in zip(x, y))
@@ -0,0 +1,77 @@
+import numpy as np
+import map
+import transition
+import history as h
+import observers
+
+# Coarse-to-fine warm start for the vectorized solvers on large mazes.
+# Each coarser level pools 2x2 blocks of tiles into one tile, which is a wall when at most one
+# of its tiles is open. One coarse move stands for two fine moves, so a coarse level discounts
+# by the square of the finer discount factor and collects (1 + discount) times the largest
+# reward of the open tiles of each block, so that a goal in a block is not averaged away.
+# Levels are solved from the coarsest up, and the utilities of each level are upsampled as
+# the initial utilities of the next finer one
+
+# Levels are coarsened until neither side is longer than this
+MIN_SIZE = 32
+
+
+def coarsen(walls, reward):
+    # Pool 2x2 blocks of a (rows, cols) wall mask and reward grid, padding odd sides with walls
+    rows, cols = walls.shape
+    padding = ((0, rows % 2), (0, cols % 2))
+    walls = np.pad(walls, padding, constant_values=True)
+    reward = np.pad(reward, padding)
+    shape = (walls.shape[0] // 2, 2, walls.shape[1] // 2, 2)
+    open_tiles = (~walls).reshape(shape).sum(axis=(1, 3))
+    reward_max = np.where(walls, -np.inf, reward).reshape(shape).max(axis=(1, 3))
+    return open_tiles < 2, np.where(open_tiles, reward_max, 0)
+
+
+def level_model(walls, reward, probability_of_success, probability_of_failure, discount_factor):
+    # Transition model of a coarse level, with a reward grid instead of tile rewards
+    tiles = np.where(walls, map.WALL, map.TILE_CODES['N']).astype(np.uint8)
+    maze = map.Maze(*walls.shape, tiles=tiles)
+    model = transition.TransitionModel(maze, {tile: 0 for tile in map.TILES}, probability_of_success,
+                                       probability_of_failure, discount_factor)
+    model.reward = reward.ravel()
+    return model
+
+
+def fill_walls(utilities):
+    # Give each wall (-inf) the largest utility of its neighbours, spreading until none are left
+    utilities = utilities.copy()
+    if np.isneginf(utilities).all():
+        return np.zeros_like(utilities)
+    while np.isneginf(utilities).any():
+        padded = np.pad(utilities, 1, constant_values=-np.inf)
+        neighbours = np.maximum.reduce([padded[:-2, 1:-1], padded[2:, 1:-1], padded[1:-1, :-2], padded[1:-1, 2:]])
+        utilities = np.where(np.isneginf(utilities), neighbours, utilities)
+    return utilities
+
+
+def upsample(utilities, rows, cols):
+    # Utility of each tile of the finer level from the (rows / 2, cols / 2) coarse utilities
+    return fill_walls(utilities).repeat(2, axis=0).repeat(2, axis=1)[:rows, :cols]
+
+
+def initial_utility(maze: map.Maze, reward, probability_of_success, probability_of_failure, discount_factor,
+                    iterations, epsilon, min_size=MIN_SIZE, observer=observers.NULL_OBSERVER):
+    # Solve the coarse levels of a maze with vectorized value iteration and return the
+    # upsampled utility of every state of the maze, or None if the maze is already small
+    walls, step_reward, discount = maze.walls, maze.reward_grid(reward), discount_factor
+    levels = []
+    while max(walls.shape) > min_size:
+        walls, step_reward = coarsen(walls, step_reward)
+        step_reward, discount = step_reward * (1 + discount), discount ** 2
+        levels.append((walls, step_reward, discount))
+    utilities = None
+    for walls, step_reward, discount in reversed(levels):
+        model = level_model(walls, step_reward, probability_of_success, probability_of_failure, discount)
+        initial = None if utilities is None else upsample(utilities, model.rows, model.cols).ravel()
+        with observer.span(f"level_{model.rows}x{model.cols}"):
+            q = transition.value_iteration(model, iterations, epsilon, h.NoHistory(model.rows, model.cols), initial=initial)
+        utilities = q.max(axis=0)
+    if utilities is None:
+        return None
+    return upsample(utilities, maze.rows, maze.cols).ravel()
@@ -0,0 +1,105 @@
+import cProfile
+import json
+import pstats
+import time
+from contextlib import ExitStack, contextmanager, nullcontext
+
+# Observers receive one record per solver iteration through iteration(record), a dict with
+# at least 'solver', 'iteration', 'seconds' (wall time of the iteration), 'delta' (largest
+# change in utility, None if the solver does not track it) and 'backups' (states backed up),
+# and wrap each solver phase in span(phase).
+# Solvers skip building records when observer.enabled is False
+
+
+class Observer:
+    # Does nothing, the default for every solver
+    enabled = False
+
+    def iteration(self, record):
+        pass
+
+    def span(self, phase):
+        return nullcontext()
+
+    def close(self):
+        pass
+
+
+NULL_OBSERVER = Observer()
+
+
+class Collector(Observer):
+    # Keep every record in memory
+    enabled = True
+
+    def __init__(self):
+        self.records = []
+
+    def iteration(self, record):
+        self.records.append(record)
+
+
+class JsonLinesWriter(Observer):
+    # Write every record as one JSON line to a file
+    enabled = True
+
+    def __init__(self, path):
+        self.file = open(path, 'w')
+
+    def iteration(self, record):
+        self.file.write(json.dumps(record) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class SpanProfiler(Observer):
+    # Total wall time and calls of each solver phase, and with profile=True a cProfile
+    # profile of everything run inside the phases
+    enabled = True
+
+    def __init__(self, profile=False):
+        self.seconds = {}
+        self.calls = {}
+        self.profiler = cProfile.Profile() if profile else None
+
+    @contextmanager
+    def span(self, phase):
+        start = time.perf_counter()
+        if self.profiler is not None:
+            self.profiler.enable()
+        try:
+            yield
+        finally:
+            if self.profiler is not None:
+                self.profiler.disable()
+            self.seconds[phase] = self.seconds.get(phase, 0.0) + time.perf_counter() - start
+            self.calls[phase] = self.calls.get(phase, 0) + 1
+
+    def stats(self):
+        # pstats.Stats of the profiled phases
+        return pstats.Stats(self.profiler)
+
+
+class Observers(Observer):
+    # Send records and spans to several observers
+    enabled = True
+
+    def __init__(self, *observers):
+        self.observers = observers
+
+    def iteration(self, record):
+        for observer in self.observers:
+            if observer.enabled:
+                observer.iteration(record)
+
+    @contextmanager
+    def span(self, phase):
+        with ExitStack() as stack:
+            for observer in self.observers:
+                stack.enter_context(observer.span(phase))
+            yield
+
+    def close(self):
+        for observer in self.observers:
+            observer.close()
@@ -0,0 +1,109 @@
+import os
+import time
+from multiprocessing import Pool, shared_memory
+import numpy as np
+import map
+import transition
+import observers
+
+# Arrays of the maze being solved, attached to shared memory in each worker process
+shared = {}
+
+
+def create_shared(name, shape, dtype, blocks):
+    # Allocate an array in a new shared memory block, keeping the block in blocks
+    block = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize))
+    blocks[name] = (block, shape, np.dtype(dtype).str)
+    return np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def attach(layout, parameters):
+    # Worker initializer, layout is {array name: (block name, shape, dtype)}
+    for name, (block_name, shape, dtype) in layout.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        shared[name] = (block, np.ndarray(shape, dtype=dtype, buffer=block.buf))
+    shared['parameters'] = parameters
+
+
+def sweep_band(start, stop, source, target):
+    # Back up rows start to stop of the maze, reading utilities from the source
+    # array (with a one-row halo above and below) and writing them to the target array
+    # Also writes the utility of each tile of the band (-inf on walls) to the utility array
+    # Returns the largest change in utility of the band
+    probability_of_success, probability_of_failure, discount_factor = shared['parameters']
+    q_source, q_target = shared[source][1], shared[target][1]
+    move_mask, reward, walls = shared['move_mask'][1], shared['reward'][1], shared['walls'][1]
+    rows, cols = move_mask.shape
+    low, high = max(0, start - 1), min(rows, stop + 1)
+    # Utility of the band and its halo, padded by one tile on every side
+    padded = np.zeros((high - low + 2, cols + 2))
+    padded[1:-1, 1:-1] = q_source[:, low:high].max(axis=0)
+    first = start - low + 1
+    own = padded[first:first + stop - start, 1:-1]
+    mask = move_mask[start:stop]
+    next_utility = np.empty((len(transition.ACTION_OFFSETS), stop - start, cols))
+    legal = np.empty((len(transition.ACTION_OFFSETS), stop - start, cols), dtype=bool)
+    for action, (d_row, d_col) in enumerate(transition.ACTION_OFFSETS):
+        legal[action] = (mask >> action & 1).astype(bool)
+        shifted = padded[first + d_row:first + d_row + stop - start, 1 + d_col:1 + d_col + cols]
+        next_utility[action] = np.where(legal[action], shifted, own)
+    expected = (probability_of_success * next_utility
+                + probability_of_failure * np.roll(next_utility, -1, axis=0)
+                + probability_of_failure * np.roll(next_utility, 1, axis=0))
+    q = reward[start:stop] + discount_factor * expected
+    # Illegal moves (and walls) keep a utility of 0
+    q[~(legal & ~walls[start:stop])] = 0
+    delta = np.abs(q - q_source[:, start:stop]).max() if q.size else 0.0
+    q_target[:, start:stop] = q
+    shared['utility'][1][start:stop] = np.where(walls[start:stop], -np.inf, q.max(axis=0))
+    return delta
+
+
+def value_iteration(maze: map.Maze, reward, probability_of_success, probability_of_failure, discount_factor,
+                    iterations, epsilon, history=None, workers=None, bands=None, observer=observers.NULL_OBSERVER):
+    # Synchronous value iteration with the grid split into row bands, each backed up by
+    # a worker process. Utilities live in shared memory, two copies that swap roles every
+    # iteration, so each worker reads its halo rows from the last iteration directly
+    # Gives the same utilities, and converges after the same iterations, as transition.value_iteration
+    # The parent only waits for the bands, the utility grid each iteration recorded in history
+    # is also written by the workers
+    # Returns the (action, row, col) utilities
+    workers = workers or os.cpu_count()
+    bands = min(bands or workers, maze.rows)
+    walls = maze.walls
+    blocks = {}
+    try:
+        create_shared('move_mask', maze.move_mask.shape, np.uint8, blocks)[:] = maze.move_mask
+        create_shared('reward', maze.tiles.shape, np.float64, blocks)[:] = maze.reward_grid(reward)
+        create_shared('walls', maze.tiles.shape, bool, blocks)[:] = walls
+        utility = create_shared('utility', maze.tiles.shape, np.float64, blocks)
+        q_shape = (len(transition.ACTION_OFFSETS), maze.rows, maze.cols)
+        q = {'current': create_shared('current', q_shape, np.float64, blocks),
+             'next': create_shared('next', q_shape, np.float64, blocks)}
+        q['current'][:] = 0
+        layout = {name: (block.name, shape, dtype) for name, (block, shape, dtype) in blocks.items()}
+        edges = np.linspace(0, maze.rows, bands + 1).astype(int)
+        source, target = 'current', 'next'
+        with Pool(workers, initializer=attach, initargs=(layout, (probability_of_success, probability_of_failure, discount_factor))) as pool:
+            states = int((~walls).sum())
+            for iteration in range(iterations):
+                started = time.perf_counter()
+                with observer.span('sweep'):
+                    delta = max(pool.starmap(sweep_band, [(start, stop, source, target) for start, stop in zip(edges[:-1], edges[1:])]))
+                source, target = target, source
+                if history is not None:
+                    history.record(utility)
+                if observer.enabled:
+                    observer.iteration({'solver': 'value_parallel', 'iteration': iteration, 'seconds': time.perf_counter() - started,
+                                        'delta': float(delta), 'backups': states, 'bands': bands})
+                if delta < epsilon:
+                    print(f"Converged after {iteration} iterations. Delta: {delta}")
+                    break
+        result = q[source].copy()
+        result[:, walls] = -np.inf
+        return result
+    finally:
+        q = utility = None
+        for block, _, _ in blocks.values():
+            block.close()
+            block.unlink()
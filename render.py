@@ -0,0 +1,153 @@
+import math
+import numpy as np
+from matplotlib.colors import to_rgb
+from matplotlib.figure import Figure
+import map
+
+# Headless rendering of large mazes to image files. Figures are built without pyplot,
+# so no GUI backend is loaded and nothing blocks
+
+TILE_COLOURS = {
+    'W': 'black',
+    'S': 'green',
+    'B': 'brown',
+    'G': 'lightgreen',
+    'N': 'white',
+}
+
+# Arrow of each action on screen as (x, y), in the same order as agent.CARDINAL_DIRECTIONS
+ARROWS = np.array([(0, 1), (1, 0), (0, -1), (-1, 0)], dtype=float)
+DIRECTIONS = ('North', 'East', 'South', 'West')
+
+# Mazes with more tiles than this are drawn without value labels and grid lines
+LABEL_LIMIT = 400
+# At most this many arrows are drawn along each side, sampling every few tiles beyond it
+ARROW_LIMIT = 200
+# Largest figure side in inches
+FIGURE_LIMIT = 20
+# Most utility values of the history aggregated at once
+HISTORY_CHUNK_VALUES = 1 << 22
+
+
+def policy_indices(policy_map):
+    # Action index of every tile from a policy map of direction names or of action
+    # indices, -1 for tiles without a direction
+    policy_map = np.asarray(policy_map)
+    if policy_map.dtype.kind in 'iu':
+        return policy_map.astype(np.intp)
+    indices = {direction: index for index, direction in enumerate(DIRECTIONS)}
+    return np.array([indices.get(action, -1) for action in policy_map.ravel()], dtype=np.intp).reshape(policy_map.shape)
+
+
+def tile_image(maze: map.Maze):
+    # RGB image of the maze with one pixel per tile
+    colours = np.array([to_rgb(TILE_COLOURS[tile]) for tile in map.TILES])
+    return colours[maze.tiles]
+
+
+def render_policy(maze: map.Maze, policy_map, value_map, title, path, label_limit=LABEL_LIMIT, arrow_limit=ARROW_LIMIT):
+    # Write the tiles and policy arrows of a maze to an image file (format from the path,
+    # e.g. .png or .svg). Values are written on each tile of small mazes only, and
+    # value_map may be None. Tiles without a finite value (walls, and tiles not reachable
+    # when only the reachable states were solved) get neither an arrow nor a label
+    scale = min(1.0, FIGURE_LIMIT / max(maze.rows, maze.cols))
+    fig = Figure(figsize=(max(maze.cols * scale, 2), max(maze.rows * scale, 2)))
+    ax = fig.subplots()
+    ax.imshow(tile_image(maze), interpolation='nearest', origin='upper')
+    shown = ~maze.walls
+    if value_map is not None:
+        shown &= np.isfinite(np.asarray(value_map, dtype=np.float64))
+
+    # One arrow every `stride` tiles along each side
+    stride = max(1, math.ceil(max(maze.rows, maze.cols) / arrow_limit))
+    actions = policy_indices(policy_map)[::stride, ::stride]
+    rows, cols = np.nonzero((actions >= 0) & shown[::stride, ::stride])
+    arrows = ARROWS[actions[rows, cols]]
+    labelled = maze.rows * maze.cols <= label_limit
+    # Leave room for the value label under the arrow
+    offset = -0.1 if labelled else 0
+    ax.quiver(cols * stride, rows * stride + offset, arrows[:, 0], arrows[:, 1], pivot='middle',
+              units='xy', scale=1 / (0.5 * stride), width=0.06 * stride, headwidth=4)
+
+    if labelled:
+        if value_map is not None:
+            for row, col in zip(*np.nonzero(shown)):
+                ax.text(col, row + 0.3, value_map[row][col], ha='center', va='center', fontsize=10, color='black')
+        ax.set_xticks(np.arange(maze.cols + 1) - 0.5, minor=True)
+        ax.set_yticks(np.arange(maze.rows + 1) - 0.5, minor=True)
+        ax.grid(which="minor", color="black", linestyle='-', linewidth=2)
+    ax.tick_params(which="both", bottom=False, left=False, labelbottom=False, labelleft=False)
+    ax.set_title(title)
+    # At least one pixel per tile
+    fig.savefig(path, dpi=max(100, math.ceil(max(maze.rows, maze.cols) / FIGURE_LIMIT)))
+
+
+def history_aggregates(iterations, utilities, open_tiles, max_points=1000, chunk_values=HISTORY_CHUNK_VALUES):
+    # Per-iteration statistics over the open_tiles mask of a (recorded, rows, cols) history,
+    # computed in float32 a block of iterations at a time, each of at most about chunk_values
+    # values. Returns the iterations kept (at most max_points, evenly spaced), the
+    # 5/25/50/75/95th percentiles of utility at each, and the largest and mean change in
+    # utility since the previous recorded iteration
+    kept = np.unique(np.linspace(0, len(iterations) - 1, min(max_points, len(iterations))).astype(int))
+    percentiles = np.empty((len(kept), 5))
+    max_change = np.zeros(len(utilities))
+    mean_change = np.zeros(len(utilities))
+    open_tiles = open_tiles.ravel()
+    chunk = max(1, chunk_values // max(1, int(open_tiles.sum())))
+    previous = None
+    for start in range(0, len(utilities), chunk):
+        block = np.asarray(utilities[start:start + chunk]).reshape(-1, open_tiles.size)[:, open_tiles]
+        block = block.astype(np.float32, copy=False)
+        end = start + len(block)
+        # Change into each iteration of the block, from the last one of the previous block
+        # for the first (the very first iteration has none)
+        if previous is not None:
+            change = np.abs(block[0] - previous)
+            max_change[start] = change.max()
+            mean_change[start] = change.mean(dtype=np.float64)
+        if len(block) > 1:
+            change = np.diff(block, axis=0)
+            np.abs(change, out=change)
+            max_change[start + 1:end] = change.max(axis=1)
+            mean_change[start + 1:end] = change.mean(axis=1, dtype=np.float64)
+        in_block = kept[(kept >= start) & (kept < end)]
+        if len(in_block):
+            percentiles[np.searchsorted(kept, in_block)] = np.percentile(block[in_block - start], [5, 25, 50, 75, 95], axis=1).T
+        previous = block[-1]
+    return np.asarray(iterations)[kept], percentiles, max_change[kept], mean_change[kept]
+
+
+def render_history(utility_history, maze: map.Maze, title, path, sample=0, max_points=1000, seed=0):
+    # Write convergence plots of a history recorder to an image file: percentile bands of
+    # the utility of all tiles, the utility of `sample` random tiles, and the largest and
+    # mean change in utility per recorded iteration, each with at most max_points points
+    iterations, utilities = utility_history.iterations, utility_history.as_array()
+    fig = Figure(figsize=(10, 8))
+    utility_ax, change_ax = fig.subplots(2, 1, sharex=True)
+    # Tiles with a finite utility, which leaves out walls and the tiles that are not states
+    # when only the reachable states were solved (-inf throughout)
+    open_tiles = np.isfinite(utilities[-1]) if len(iterations) else ~maze.walls
+    if len(iterations) and open_tiles.any():
+        kept, percentiles, max_change, mean_change = history_aggregates(iterations, utilities, open_tiles, max_points)
+        utility_ax.fill_between(kept, percentiles[:, 0], percentiles[:, 4], alpha=0.2, color='tab:blue', label="5-95th percentile")
+        utility_ax.fill_between(kept, percentiles[:, 1], percentiles[:, 3], alpha=0.4, color='tab:blue', label="25-75th percentile")
+        utility_ax.plot(kept, percentiles[:, 2], color='tab:blue', label="Median")
+        if sample:
+            rng = np.random.default_rng(seed)
+            tiles = np.flatnonzero(open_tiles.ravel())
+            index = np.searchsorted(iterations, kept)
+            for tile in rng.choice(tiles, min(sample, len(tiles)), replace=False):
+                row, col = divmod(int(tile), maze.cols)
+                utility_ax.plot(kept, utilities[index, row, col], linewidth=0.8, alpha=0.6)
+        change_ax.plot(kept[1:], max_change[1:], label="Largest change")
+        change_ax.plot(kept[1:], mean_change[1:], label="Mean change")
+        change_ax.set_yscale('log')
+        utility_ax.legend(loc="lower right", fontsize="small")
+        change_ax.legend(loc="upper right", fontsize="small")
+    utility_ax.set_ylabel("Utility Value")
+    utility_ax.set_title(title)
+    utility_ax.grid()
+    change_ax.set_xlabel("Iteration")
+    change_ax.set_ylabel("Change in Utility")
+    change_ax.grid()
+    fig.savefig(path)
@@ -0,0 +1,48 @@
+import numpy as np
+import transition
+
+
+def simulate(model: transition.TransitionModel, policy, start, episodes, horizon, terminal=None, seed=None):
+    # Run `episodes` agents at once from the flat start state, each following the policy
+    # (action index per state) under the 0.8/0.1/0.1 slip model for at most `horizon` steps.
+    # An episode also ends after collecting the reward of a state where terminal is True
+    # Returns the discounted return and the length of every episode
+    if model.walls[start]:
+        raise ValueError("Start position is a wall")
+    rng = np.random.default_rng(seed)
+    state = np.full(episodes, start, dtype=np.intp)
+    returns = np.zeros(episodes)
+    lengths = np.full(episodes, horizon, dtype=np.int64)
+    alive = np.arange(episodes)
+    discount = 1.0
+    for step in range(horizon):
+        current = state[alive]
+        returns[alive] += discount * model.reward[current]
+        if terminal is not None:
+            done = terminal[current]
+            if done.any():
+                lengths[alive[done]] = step + 1
+                alive, current = alive[~done], current[~done]
+                if not len(alive):
+                    break
+        # Slip to the left or right of the intended action with the probability of failure each
+        draw = rng.random(len(alive))
+        action = policy[current]
+        action = np.where(draw < model.probability_of_success, action,
+                          np.where(draw < model.probability_of_success + model.probability_of_failure,
+                                   (action + 1) % 4, (action - 1) % 4))
+        state[alive] = model.next_state[action, current]
+        discount *= model.discount_factor
+    return returns, lengths
+
+
+def summarise(returns, lengths):
+    # Statistics of the discounted returns and distribution of the episode lengths
+    return {
+        'episodes': len(returns),
+        'mean_return': float(returns.mean()),
+        'std_return': float(returns.std()),
+        'stderr_return': float(returns.std() / np.sqrt(len(returns))),
+        'mean_length': float(lengths.mean()),
+        'length_counts': dict(zip(*(values.tolist() for values in np.unique(lengths, return_counts=True)))),
+    }
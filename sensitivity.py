@@ -0,0 +1,144 @@
+import itertools
+import time
+import numpy as np
+import map
+import transition
+import observers
+
+# Value iteration of one maze under many (discount factor, slip, reward) settings at once.
+# The transition structure of the maze is built once and shared by every setting, and each
+# sweep backs up every setting in one pass. Utilities are returned with a leading setting axis,
+# but are kept as (action, state, setting) while solving, so that gathering the utilities of
+# the next states reads the values of all settings of a state together. Sweeps go through the
+# states a block at a time, small enough for the block of every setting to stay in cache
+
+# Most (action, state, setting) values backed up together in one block of a sweep
+BLOCK_VALUES = 1 << 16
+# Settings that have converged keep being backed up with the others until at most this
+# fraction of the settings is left, and only then are the others copied to narrower arrays
+COMPACT_FRACTION = 0.75
+
+
+def settings_grid(discount_factors, slips, rewards):
+    # Every combination of the given values as (discount factor, slip, reward) settings,
+    # where slip is the probability of moving to each side instead of the intended direction
+    # and reward is a {tile: reward} dictionary
+    return list(itertools.product(discount_factors, slips, rewards))
+
+
+class SettingsModel:
+    # Per-setting parameters on top of one transition structure of the maze, shared by all settings
+    # With start, only the tiles reachable from it are states, as in transition.TransitionModel
+    def __init__(self, maze: map.Maze, settings, start=None):
+        self.settings = list(settings)
+        if not self.settings:
+            raise ValueError("Invalid settings, at least one setting is needed")
+        discount_factors, slips, rewards = zip(*self.settings)
+        slips = np.array(slips, dtype=np.float64)
+        if ((slips < 0) | (slips > 0.5)).any():
+            raise ValueError("Invalid slip, must be between 0 and 0.5")
+        # The model of the first setting provides the structure, its own parameters are not used
+        model = transition.TransitionModel(maze, rewards[0], 1 - 2 * slips[0], slips[0], discount_factors[0], start)
+        self.model = model
+        # Per-setting vectors, which broadcast over the trailing setting axis of the utilities
+        self.discount_factor = np.array(discount_factors, dtype=np.float64)
+        self.probability_of_success = 1 - 2 * slips
+        self.probability_of_failure = slips
+        # Rewards of each state from a (tile, setting) table, rather than Maze.reward_grid, which
+        # would keep a full grid cached on the maze for every reward of the sweep
+        table = np.array([[reward[tile] for reward in rewards] for tile in map.TILES], dtype=np.float64)
+        self.reward = table[model.from_grid(maze.tiles)]
+        # The discount factor is folded into the probabilities, and illegal moves (and walls)
+        # are multiplied by 0 so that they keep a utility of 0
+        self.success = self.discount_factor * self.probability_of_success
+        self.slip = self.discount_factor * self.probability_of_failure
+        self.legal = model.legal[:, :, np.newaxis].astype(np.float64)
+
+    def select(self, settings):
+        # Model of the given setting indices only, sharing the transition structure
+        selected = object.__new__(SettingsModel)
+        selected.__dict__.update(self.__dict__)
+        selected.settings = [self.settings[setting] for setting in settings]
+        selected.discount_factor = self.discount_factor[settings]
+        selected.probability_of_success = self.probability_of_success[settings]
+        selected.probability_of_failure = self.probability_of_failure[settings]
+        selected.success = self.success[settings]
+        selected.slip = self.slip[settings]
+        selected.reward = self.reward[:, settings]
+        return selected
+
+    def sweep(self, state_utility, q, new_utility):
+        # Bellman backup of every (action, state, setting) from the (state, setting) utilities,
+        # written over q, with the best of each state written to new_utility
+        # Returns the largest change in q of each setting
+        actions, size = self.model.next_state.shape
+        delta = np.zeros(state_utility.shape[1])
+        block = max(1, BLOCK_VALUES // (actions * state_utility.shape[1]))
+        for start in range(0, size, block):
+            end = min(start + block, size)
+            # Utilities of the states each action leads to, the one gather of the block
+            backup = state_utility[self.model.next_state[:, start:end]]
+            # Slipping from North or South leads East or West and the other way round, so the
+            # two actions of an axis share their slip term
+            across = backup[1] + backup[3]
+            across *= self.slip
+            along = backup[0] + backup[2]
+            along *= self.slip
+            backup *= self.success
+            backup[0::2] += across
+            backup[1::2] += along
+            backup += self.reward[start:end]
+            backup *= self.legal[:, start:end]
+            np.max(backup, axis=0, out=new_utility[start:end])
+            change = q[:, start:end]
+            change -= backup
+            np.abs(change, out=change)
+            np.maximum(delta, change.max(axis=(0, 1)), out=delta)
+            change[...] = backup
+        return delta
+
+
+def value_iteration(maze: map.Maze, settings, iterations, epsilon, observer=observers.NULL_OBSERVER, start=None):
+    # Synchronous value iteration of every setting. Settings whose own change in utility is
+    # below epsilon are set aside, and the remaining ones keep being backed up together
+    # start is the grid index of the start tile, to solve only the tiles reachable from it
+    # Returns the (setting, action, row, col) utilities and the iterations each setting took
+    model = SettingsModel(maze, settings, start)
+    shared = model.model
+    result = np.empty((len(transition.ACTION_OFFSETS), shared.size, len(model.settings)))
+    converged_after = np.full(len(model.settings), iterations, dtype=np.int64)
+    # Original index of each setting in the arrays, and whether it is still being backed up
+    active = np.arange(len(model.settings))
+    running = np.ones(len(model.settings), dtype=bool)
+    q = np.zeros((len(transition.ACTION_OFFSETS), shared.size, len(model.settings)))
+    state_utility = np.zeros((shared.size, len(model.settings)))
+    new_utility = np.empty_like(state_utility)
+    states = int((~shared.walls).sum())
+    for iteration in range(iterations):
+        start = time.perf_counter()
+        with observer.span('sweep'):
+            # delta is the actual change in utility of any state, per setting
+            delta = model.sweep(state_utility, q, new_utility)
+            state_utility, new_utility = new_utility, state_utility
+        if observer.enabled:
+            observer.iteration({'solver': 'value_settings', 'iteration': iteration, 'seconds': time.perf_counter() - start,
+                                'delta': float(delta[running].max()), 'backups': states * int(running.sum())})
+        done = running & (delta < epsilon)
+        if done.any():
+            result[:, :, active[done]] = q[:, :, done]
+            converged_after[active[done]] = iteration
+            running &= ~done
+            if not running.any():
+                print(f"Converged after {iteration} iterations.")
+                break
+            if running.sum() <= COMPACT_FRACTION * len(running):
+                remaining = np.flatnonzero(running)
+                active, q, state_utility, model = active[remaining], q[:, :, remaining], state_utility[:, remaining], model.select(remaining)
+                new_utility = np.empty_like(state_utility)
+                running = np.ones(len(remaining), dtype=bool)
+    result[:, :, active[running]] = q[:, :, running]
+    result[:, shared.walls] = -np.inf
+    # Scatter the states back to the grid, tiles that are not states are -inf like walls
+    grid = np.full((result.shape[2], len(transition.ACTION_OFFSETS), shared.rows * shared.cols), -np.inf)
+    grid[:, :, shared.states] = result.transpose(2, 0, 1)
+    return grid.reshape(-1, len(transition.ACTION_OFFSETS), shared.rows, shared.cols), converged_after
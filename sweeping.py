@@ -0,0 +1,124 @@
+import heapq
+import time
+import numpy as np
+import transition
+import observers
+
+
+class PrioritizedSweeping:
+    # In-place (Gauss-Seidel) value iteration that backs up one state at a time,
+    # always the one with the largest Bellman error, and only re-checks the
+    # states whose backup depends on a state that just changed
+    def __init__(self, model: transition.TransitionModel, state_utility=None):
+        self.model = model
+        self.utility = np.zeros(model.size).tolist() if state_utility is None else np.asarray(state_utility, dtype=np.float64).tolist()
+        self.reward = model.reward.tolist()
+        self.next_state = model.next_state.tolist()
+        self.legal = model.legal.T.tolist()
+        # A state with an illegal move has a utility of at least 0
+        self.floor = np.where(model.legal.all(axis=0), -np.inf, 0.0).tolist()
+        self.walls = model.walls.tolist()
+        self.states = int((~model.walls).sum())
+        self.error = [0.0] * model.size
+        self.queue = []
+        self.backups = 0
+
+    def backup(self, state):
+        # Bellman backup of one state from the current utilities
+        utility, next_state = self.utility, self.next_state
+        success, failure = self.model.probability_of_success, self.model.probability_of_failure
+        best = self.floor[state]
+        for action, legal in enumerate(self.legal[state]):
+            if not legal:
+                continue
+            expected = (success * utility[next_state[action][state]]
+                        + failure * utility[next_state[(action + 1) % 4][state]]
+                        + failure * utility[next_state[(action - 1) % 4][state]])
+            best = max(best, self.reward[state] + self.model.discount_factor * expected)
+        return best
+
+    def check(self, state, epsilon):
+        # Queue the state if its Bellman error is at least epsilon
+        if self.walls[state]:
+            return
+        error = abs(self.backup(state) - self.utility[state])
+        if error >= epsilon:
+            if error != self.error[state]:
+                heapq.heappush(self.queue, (-error, state))
+            self.error[state] = error
+        else:
+            self.error[state] = 0.0
+
+    def predecessors(self, state):
+        # Moves are legal both ways between non-wall tiles, so the states a state can
+        # reach are the states that can reach it
+        return {self.next_state[action][state] for action in range(len(transition.ACTION_OFFSETS))} | {state}
+
+    def run(self, states, epsilon, max_backups, history=None, observer=observers.NULL_OBSERVER):
+        # Sweep from the given states until every Bellman error is below epsilon
+        with observer.span('sweeping'):
+            return self.sweep(states, epsilon, max_backups, history, observer)
+
+    def sweep(self, states, epsilon, max_backups, history, observer):
+        for state in states:
+            self.check(state, epsilon)
+        start = time.perf_counter()
+        while self.queue and self.backups < max_backups:
+            error, state = heapq.heappop(self.queue)
+            if -error != self.error[state]:
+                # Stale entry, the state has been backed up or re-queued since
+                continue
+            self.utility[state] = self.backup(state)
+            self.error[state] = 0.0
+            self.backups += 1
+            for predecessor in self.predecessors(state):
+                self.check(predecessor, epsilon)
+            if self.backups % self.states:
+                continue
+            # Record once per sweep's worth of backups
+            if history is not None:
+                history.record(self.model.state_grid(np.array(self.utility)))
+            if observer.enabled:
+                now = time.perf_counter()
+                observer.iteration({'solver': 'value_prioritized', 'iteration': self.backups // self.states - 1,
+                                    'seconds': now - start, 'delta': -self.queue[0][0] if self.queue else 0.0,
+                                    'backups': self.states, 'queued': len(self.queue)})
+                start = now
+        return not self.queue
+
+    def state_utility(self):
+        return np.array(self.utility)
+
+
+def prioritized_value_iteration(model: transition.TransitionModel, iterations, epsilon, history,
+                                observer=observers.NULL_OBSERVER):
+    # Backs up at most as many states as `iterations` full sweeps would
+    # Returns the (action, row, col) utilities
+    solver = PrioritizedSweeping(model)
+    states = np.flatnonzero(~model.walls)
+    if solver.run(states.tolist(), epsilon, iterations * len(states), history, observer):
+        print(f"Converged after {solver.backups} backups.")
+    history.record(model.state_grid(solver.state_utility()))
+    return model.to_grid(model.q_values(solver.state_utility()))
+
+
+def resolve(model: transition.TransitionModel, state_utility, changed_cells, iterations, epsilon,
+            observer=observers.NULL_OBSERVER):
+    # Re-solve a maze after a few tiles changed, starting from the state utilities solved
+    # before the change. Only the changed tiles and their neighbours are checked at first,
+    # and the sweep spreads from them as far as utilities keep changing by epsilon or more
+    # Returns the new state utilities, walls are 0
+    state_utility = np.where(np.isfinite(state_utility), state_utility, 0).ravel()
+    states = set()
+    for row, col in changed_cells:
+        states.add(row * model.cols + col)
+        for d_row, d_col in transition.ACTION_OFFSETS:
+            if 0 <= row + d_row < model.rows and 0 <= col + d_col < model.cols:
+                states.add((row + d_row) * model.cols + col + d_col)
+    for state in states:
+        if model.walls[state]:
+            state_utility[state] = 0
+    solver = PrioritizedSweeping(model, state_utility)
+    if solver.run(sorted(states), epsilon, iterations * max(1, solver.states), observer=observer):
+        print(f"Converged after {solver.backups} backups.")
+    return solver.state_utility()
@@ -0,0 +1,225 @@
+import time
+import numpy as np
+import map
+import observers
+
+ACTION_OFFSETS = map.MOVE_OFFSETS
+
+
+def reachable_states(next_state, legal, start):
+    # Mask of the states reachable from start through possible moves, by breadth-first search
+    reachable = np.zeros(next_state.shape[1], dtype=bool)
+    reachable[start] = True
+    frontier = np.array([start])
+    while len(frontier):
+        neighbours = next_state[:, frontier][legal[:, frontier]]
+        frontier = np.unique(neighbours[~reachable[neighbours]])
+        reachable[frontier] = True
+    return reachable
+
+
+class TransitionModel:
+    # Precomputed 0.8/0.1/0.1 transition structure of a maze as flat index arrays.
+    # States are the cells of the grid in row-major order (index = row * cols + col).
+    # With start (the grid index of the start tile), only the tiles reachable from start are
+    # states, numbered densely in row-major order, and walls and the other tiles are left out
+    def __init__(self, maze, reward, probability_of_success, probability_of_failure, discount_factor, start=None):
+        self.rows, self.cols = maze.rows, maze.cols
+        self.size = self.rows * self.cols
+        self.walls = maze.walls.ravel()
+        self.reward = maze.reward_grid(reward).ravel()
+        self.probability_of_success = probability_of_success
+        self.probability_of_failure = probability_of_failure
+        self.discount_factor = discount_factor
+
+        state = np.arange(self.size)
+        move_mask = maze.move_mask.ravel()
+        # next_state[a, s] is where action a leads from s, or s itself if the move is blocked
+        # legal[a, s] is whether action a is a possible move from s
+        self.next_state = np.empty((len(ACTION_OFFSETS), self.size), dtype=np.intp)
+        self.legal = np.empty((len(ACTION_OFFSETS), self.size), dtype=bool)
+        for action, (d_row, d_col) in enumerate(ACTION_OFFSETS):
+            legal = (move_mask >> action & 1).astype(bool)
+            self.next_state[action] = np.where(legal, state + d_row * self.cols + d_col, state)
+            # Walls have no moves of their own
+            self.legal[action] = legal & ~self.walls
+        # states[i] is the grid index of state i
+        self.states = state
+        if start is not None:
+            if self.walls[start]:
+                raise ValueError("Invalid start, it is a wall")
+            self.states = np.flatnonzero(reachable_states(self.next_state, self.legal, start))
+            index = np.full(self.size, -1, dtype=np.intp)
+            index[self.states] = np.arange(len(self.states))
+            # Moves from a reachable tile only lead to reachable tiles
+            self.next_state = index[self.next_state[:, self.states]]
+            self.legal = self.legal[:, self.states]
+            self.walls = self.walls[self.states]
+            self.reward = self.reward[self.states]
+            self.size = len(self.states)
+
+    def q_values(self, state_utility):
+        # Bellman backup of every (action, state) pair from the utility of each state
+        next_utility = state_utility[self.next_state]
+        expected = (self.probability_of_success * next_utility
+                    + self.probability_of_failure * np.roll(next_utility, -1, axis=0)
+                    + self.probability_of_failure * np.roll(next_utility, 1, axis=0))
+        q = self.reward + self.discount_factor * expected
+        # Illegal moves (and walls) keep a utility of 0
+        q[~self.legal] = 0
+        return q
+
+    def to_grid(self, q):
+        # Scatter (action, state) values to (action, row, col) and mark walls
+        # (and tiles that are not states) with -inf
+        grid = np.full((len(ACTION_OFFSETS), self.rows * self.cols), -np.inf)
+        grid[:, self.states] = np.where(self.walls, -np.inf, q)
+        return grid.reshape(len(ACTION_OFFSETS), self.rows, self.cols)
+
+    def state_grid(self, state_utility):
+        # Scatter state values to (row, col) and mark walls (and tiles that are not states) with -inf
+        grid = np.full(self.rows * self.cols, -np.inf)
+        grid[self.states] = np.where(self.walls, -np.inf, state_utility)
+        return grid.reshape(self.rows, self.cols)
+
+    def policy_grid(self, policy):
+        # Scatter the action index of each state to (row, col), tiles that are not states get 0
+        grid = np.zeros(self.rows * self.cols, dtype=policy.dtype)
+        grid[self.states] = policy
+        return grid.reshape(self.rows, self.cols)
+
+    def from_grid(self, values):
+        # Values of each state from (row, col) or flat grid values
+        return np.ravel(values)[self.states]
+
+
+def value_iteration(model: TransitionModel, iterations, epsilon, history, observer=observers.NULL_OBSERVER, initial=None):
+    # Synchronous value iteration on whole-grid arrays, recording each iteration in history
+    # initial is the utility of each tile to start from (e.g. from multigrid.initial_utility),
+    # zeros by default. It only changes how many iterations are needed, not the epsilon test
+    # Returns the (action, row, col) utilities
+    q = np.zeros((len(ACTION_OFFSETS), model.size))
+    if initial is not None:
+        q[:] = np.where(model.walls, 0, model.from_grid(initial))
+    states = int((~model.walls).sum())
+    for iteration in range(iterations):
+        start = time.perf_counter()
+        with observer.span('sweep'):
+            new_q = model.q_values(q.max(axis=0))
+            # delta is the actual change in utility of any state
+            delta = np.abs(new_q - q).max()
+        q = new_q
+        history.record(model.state_grid(q.max(axis=0)))
+        if observer.enabled:
+            observer.iteration({'solver': 'value_vectorized', 'iteration': iteration, 'seconds': time.perf_counter() - start,
+                                'delta': float(delta), 'backups': states})
+        if delta < epsilon:
+            print(f"Converged after {iteration} iterations. Delta: {delta}")
+            break
+    return model.to_grid(q)
+
+
+def policy_values(model: TransitionModel, state_utility, policy):
+    # Bellman backup of every state under a fixed policy (action index of each state)
+    # As in q_values, an illegal move (and any move of a wall) keeps a utility of 0
+    state = np.arange(model.size)
+    left, right = (policy - 1) % len(ACTION_OFFSETS), (policy + 1) % len(ACTION_OFFSETS)
+    expected = (model.probability_of_success * state_utility[model.next_state[policy, state]]
+                + model.probability_of_failure * state_utility[model.next_state[left, state]]
+                + model.probability_of_failure * state_utility[model.next_state[right, state]])
+    return np.where(model.legal[policy, state], model.reward + model.discount_factor * expected, 0)
+
+
+def policy_matrix(model: TransitionModel, policy):
+    # Sparse state transition matrix P of a fixed policy, walls and states whose policy is an
+    # illegal move have no transitions
+    # SciPy is only imported here, so solvers that do not need it start faster
+    from scipy import sparse
+    state = np.flatnonzero(model.legal[policy, np.arange(model.size)])
+    action = policy[state]
+    targets = np.concatenate([model.next_state[action, state],
+                              model.next_state[(action - 1) % len(ACTION_OFFSETS), state],
+                              model.next_state[(action + 1) % len(ACTION_OFFSETS), state]])
+    probabilities = np.repeat([model.probability_of_success, model.probability_of_failure, model.probability_of_failure], len(state))
+    return sparse.csr_matrix((probabilities, (np.tile(state, 3), targets)), shape=(model.size, model.size))
+
+
+def policy_evaluation(model: TransitionModel, policy):
+    # Exact utility of a fixed policy by solving (I - discount * P) U = R
+    from scipy import sparse
+    from scipy.sparse import linalg as sparse_linalg
+    system = sparse.identity(model.size, format='csr') - model.discount_factor * policy_matrix(model, policy)
+    legal = model.legal[policy, np.arange(model.size)]
+    return sparse_linalg.spsolve(system.tocsc(), np.where(legal, model.reward, 0))
+
+
+def initial_policy(model: TransitionModel):
+    # First possible move of every state
+    return np.argmax(model.legal, axis=0)
+
+
+def policy_improvement(model: TransitionModel, state_utility, policy):
+    # Greedy policy over the same backup as value iteration, only switching action on a strict
+    # improvement (beyond round-off, so that tied actions do not flip back and forth)
+    # An illegal move is worth 0 there, so it is chosen where every possible move is worse,
+    # and policy iteration reaches the value iteration utilities on every maze
+    q = model.q_values(state_utility)
+    best = np.argmax(q, axis=0)
+    state = np.arange(model.size)
+    with np.errstate(invalid='ignore'):
+        improved = q[best, state] - q[policy, state] > 1e-9 * (1 + np.abs(q[policy, state]))
+    return np.where(improved, best, policy)
+
+
+def policy_iteration(model: TransitionModel, iterations, epsilon, history, method='linear', sweeps=20,
+                     observer=observers.NULL_OBSERVER, initial=None):
+    # method is 'linear' to evaluate each policy exactly with a sparse solve,
+    # or 'modified' to evaluate it with a fixed number of synchronous sweeps
+    # initial is the utility of each tile to start from, the first policy is then greedy on it
+    # Records each evaluation step in history
+    # Returns the (action, row, col) utilities and the policy
+    policy = initial_policy(model)
+    state_utility = np.zeros(model.size)
+    if initial is not None:
+        state_utility = np.where(model.walls, 0, model.from_grid(initial))
+        policy = policy_improvement(model, state_utility, policy)
+    states = int((~model.walls).sum())
+    for iteration in range(iterations):
+        # Step 1: Policy Evaluation
+        start = time.perf_counter()
+        delta = 0
+        evaluation_sweeps = 1
+        with observer.span('evaluation'):
+            if method == 'linear':
+                new_utility = policy_evaluation(model, policy)
+                delta = np.abs(new_utility - state_utility).max()
+                state_utility = new_utility
+                history.record(model.state_grid(state_utility))
+            elif method == 'modified':
+                for evaluation_sweeps in range(1, sweeps + 1):
+                    new_utility = policy_values(model, state_utility, policy)
+                    delta = np.abs(new_utility - state_utility).max()
+                    state_utility = new_utility
+                    history.record(model.state_grid(state_utility))
+                    if delta < epsilon:
+                        break
+            else:
+                raise ValueError("Invalid method")
+        evaluated = time.perf_counter()
+        # Step 2: Policy Improvement
+        with observer.span('improvement'):
+            new_policy = policy_improvement(model, state_utility, policy)
+            policy_changes = int((new_policy != policy).sum())
+        policy_changed = policy_changes > 0
+        policy = new_policy
+        if observer.enabled:
+            end = time.perf_counter()
+            observer.iteration({'solver': f"policy_{method}", 'iteration': iteration, 'seconds': end - start,
+                                'evaluation_seconds': evaluated - start, 'improvement_seconds': end - evaluated,
+                                'delta': float(delta), 'backups': states * evaluation_sweeps,
+                                'policy_changes': policy_changes})
+        # The linear solve is exact, so only the policy decides its convergence
+        if not policy_changed and (method == 'linear' or delta < epsilon):
+            print(f"Converged after {iteration} iterations.")
+            break
+    return model.to_grid(model.q_values(state_utility)), model.policy_grid(policy)